@@ -1,17 +1,30 @@
 # -*- coding: utf-8 -*-
 from trytond.pool import Pool
-from stock import ShipmentOut, Move
+from stock import ShipmentOut, Move, Location
 from report_html_stock import PickingList, SupplierRestockingList, \
     CustomerReturnRestockingList, ConsolidatedPickingList, DeliveryNote, \
     ProductLedger, ProductLedgerStartView, ProductLedgerReport, \
-    InternalShipmentReport
+    ProductLedgerExport, InternalShipmentReport
+from job import ReportJob
+from statistic import ReportStatistic
+from company import Company, Party, Address
+from snapshot import StockBalanceSnapshot
+from ledger_cache import ProductLedgerMonth
 
 
 def register():
     Pool.register(
         ShipmentOut,
         Move,
+        Location,
         ProductLedgerStartView,
+        ReportJob,
+        ReportStatistic,
+        Company,
+        Party,
+        Address,
+        StockBalanceSnapshot,
+        ProductLedgerMonth,
         module='report_html_stock', type_='model'
     )
     Pool.register(
@@ -25,6 +38,7 @@ def register():
         ConsolidatedPickingList,
         DeliveryNote,
         ProductLedgerReport,
+        ProductLedgerExport,
         InternalShipmentReport,
         module='report_html_stock', type_='report'
     )
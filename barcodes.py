@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+    Server side rendering of barcodes as inline SVG, so that the reports do
+    not need javascript to draw them.
+"""
+import threading
+
+from jinja2 import Markup, escape
+from trytond.cache import LRUDict
+
+try:
+    import qrcode
+except ImportError:
+    qrcode = None
+
+__all__ = ['barcode', 'code128_svg', 'qrcode_svg']
+
+# Bar and space widths of the code 128 symbols, indexed by symbol value
+CODE128_PATTERNS = [
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213',
+    '122312', '132212', '221213', '221312', '231212', '112232', '122132',
+    '122231', '113222', '123122', '123221', '223211', '221132', '221231',
+    '213212', '223112', '312131', '311222', '321122', '321221', '312212',
+    '322112', '322211', '212123', '212321', '232121', '111323', '131123',
+    '131321', '112313', '132113', '132311', '211313', '231113', '231311',
+    '112133', '112331', '132131', '113123', '113321', '133121', '313121',
+    '211331', '231131', '213113', '213311', '213131', '311123', '311321',
+    '331121', '312113', '312311', '332111', '314111', '221411', '431111',
+    '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114',
+    '413111', '241112', '134111', '111242', '121142', '121241', '114212',
+    '124112', '124211', '411212', '421112', '421211', '212141', '214121',
+    '412121', '111143', '111341', '131141', '114113', '114311', '411113',
+    '411311', '113141', '114131', '311141', '411131', '211412', '211214',
+    '211232',
+]
+CODE128_STOP = '2331112'
+CODE128_START_B = 104
+CODE128_START_C = 105
+
+_cache = LRUDict(1024)
+_cache_lock = threading.Lock()
+
+
+def code128_values(value):
+    """
+    Returns the symbol values encoding the string, including the start
+    symbol and the checksum. Even length numbers are encoded with code set
+    C, everything else with code set B.
+    """
+    if value.isdigit() and len(value) % 2 == 0:
+        values = [CODE128_START_C] + [
+            int(value[i:i + 2]) for i in range(0, len(value), 2)
+        ]
+    else:
+        if any(not 32 <= ord(c) < 128 for c in value):
+            raise ValueError('%r can not be encoded in code 128' % value)
+        values = [CODE128_START_B] + [ord(c) - 32 for c in value]
+    checksum = values[0] + sum(i * v for i, v in enumerate(values) if i)
+    return values + [checksum % 103]
+
+
+def code128_svg(value, height=30, module_width=1, quiet_zone=10,
+                show_text=True):
+    """
+    Returns the value as a code 128 barcode in SVG
+    """
+    widths = ''.join(
+        CODE128_PATTERNS[v] for v in code128_values(value)
+    ) + CODE128_STOP
+
+    rects = []
+    x = quiet_zone
+    for index, width in enumerate(map(int, widths)):
+        # Patterns alternate bars and spaces, starting with a bar
+        if index % 2 == 0:
+            rects.append('<rect x="%d" y="0" width="%d" height="%d"/>' % (
+                x * module_width, width * module_width, height
+            ))
+        x += width
+    total_width = (x + quiet_zone) * module_width
+
+    text = ''
+    total_height = height
+    if show_text:
+        total_height += 12
+        text = (
+            '<text x="%d" y="%d" font-size="10" text-anchor="middle" '
+            'font-family="monospace">%s</text>'
+        ) % (total_width / 2, total_height - 1, escape(value))
+
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+        'viewBox="0 0 %d %d"><g fill="#000">%s</g>%s</svg>'
+    ) % (
+        total_width, total_height, total_width, total_height,
+        ''.join(rects), text
+    )
+
+
+def qrcode_svg(value, module_width=3, quiet_zone=4, error_correction='M'):
+    """
+    Returns the value as a QR code in SVG
+    """
+    if qrcode is None:
+        raise Exception('Error', 'qrcode is required to render QR codes')
+
+    code = qrcode.QRCode(
+        border=quiet_zone,
+        error_correction=getattr(
+            qrcode.constants, 'ERROR_CORRECT_%s' % error_correction
+        ),
+    )
+    code.add_data(value)
+    code.make(fit=True)
+    matrix = code.get_matrix()
+
+    rects = []
+    for y, row in enumerate(matrix):
+        for x, dark in enumerate(row):
+            if dark:
+                rects.append('<rect x="%d" y="%d" width="1" height="1"/>' % (
+                    x, y
+                ))
+    size = len(matrix)
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+        'viewBox="0 0 %d %d" shape-rendering="crispEdges">'
+        '<g fill="#000">%s</g></svg>'
+    ) % (
+        size * module_width, size * module_width, size, size, ''.join(rects)
+    )
+
+
+RENDERERS = {
+    'code128': code128_svg,
+    'qr': qrcode_svg,
+}
+
+
+def barcode(value, type_='code128', **options):
+    """
+    Jinja filter returning the value as an inline SVG barcode::
+
+        {{ shipment.code|barcode }}
+        {{ shipment.code|barcode('qr', module_width=2) }}
+
+    The rendered barcodes are kept in a LRU cache keyed by the value, the
+    type and the options.
+    """
+    if value is None or value == '':
+        return ''
+    if not isinstance(value, basestring):
+        value = unicode(value)
+
+    key = (value, type_, tuple(sorted(options.items())))
+    with _cache_lock:
+        svg = _cache.pop(key, None)
+        if svg is None:
+            svg = Markup(RENDERERS[type_](value, **options))
+        # (Re)insert as the most recently used
+        _cache[key] = svg
+    return svg
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from trytond.cache import Cache
+from trytond.pool import PoolMeta, Pool
+
+__all__ = ['Company', 'Party', 'Address']
+__metaclass__ = PoolMeta
+
+
+class Company:
+    __name__ = 'company.company'
+
+    #: Fragments of the reports which only depend on the company and the
+    #: language, like the rendered header
+    _report_fragments_cache = Cache(
+        'company.company.report_fragments', context=False
+    )
+
+    @classmethod
+    def clear_report_fragments(cls):
+        cls._report_fragments_cache.clear()
+
+    @classmethod
+    def write(cls, *args):
+        cls.clear_report_fragments()
+        super(Company, cls).write(*args)
+
+    @classmethod
+    def delete(cls, companies):
+        cls.clear_report_fragments()
+        super(Company, cls).delete(companies)
+
+
+class Party:
+    __name__ = 'party.party'
+
+    @classmethod
+    def write(cls, *args):
+        Pool().get('company.company').clear_report_fragments()
+        super(Party, cls).write(*args)
+
+
+class Address:
+    __name__ = 'party.address'
+
+    @classmethod
+    def create(cls, vlist):
+        Pool().get('company.company').clear_report_fragments()
+        return super(Address, cls).create(vlist)
+
+    @classmethod
+    def write(cls, *args):
+        Pool().get('company.company').clear_report_fragments()
+        super(Address, cls).write(*args)
+
+    @classmethod
+    def delete(cls, addresses):
+        Pool().get('company.company').clear_report_fragments()
+        super(Address, cls).delete(addresses)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+    Stylesheet of the reports, purged from the rules of the stylesheets they
+    link which can not match the templates, and inlined in the reports.
+
+    Build the stylesheet after changing the templates with::
+
+        python css_bundle.py
+"""
+import os
+import re
+import sys
+import glob
+import threading
+
+from jinja2 import Markup
+from trytond.tools import file_open
+
+__all__ = ['purge', 'used_names', 'build', 'inline_stylesheet']
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+#: Stylesheets the bundle is built from, relative to the module
+SOURCES = [
+    'reports/css/bootstrap/css/bootstrap.min.css',
+    'reports/css/font-awesome/css/font-awesome.min.css',
+]
+#: Templates scanned for the classes, ids and elements they use
+TEMPLATES = 'reports/*.html'
+BUNDLE = 'reports/css/report.css'
+
+#: Elements which are in every report without being in the templates:
+#: the barcodes are inline SVG
+EXTRA_TAGS = ['html', 'body', 'svg', 'g', 'rect', 'text']
+
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+ATTRIBUTE_RE = re.compile(
+    r'\b(class|id)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE
+)
+TAG_RE = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)')
+NAME_RE = re.compile(r'-?[_a-zA-Z][\w-]*')
+SELECTOR_CLASS_RE = re.compile(r'\.(-?[_a-zA-Z][\w-]*)')
+SELECTOR_ID_RE = re.compile(r'#(-?[_a-zA-Z][\w-]*)')
+SELECTOR_TAG_RE = re.compile(r'(?:^|[\s>+~])([a-zA-Z][a-zA-Z0-9]*)')
+PSEUDO_RE = re.compile(r'::?[\w-]+(\([^)]*\))?|\[[^\]]*\]')
+
+
+def used_names(templates):
+    """
+    Returns the sets of classes, ids and elements used by the templates.
+    Every word of a class attribute is taken as a class, so classes set by
+    template expressions in the attribute are kept.
+    """
+    classes, ids, tags = set(), set(), set(EXTRA_TAGS)
+    for template in templates:
+        for attribute, double, single in ATTRIBUTE_RE.findall(template):
+            names = NAME_RE.findall(double or single)
+            if attribute.lower() == 'class':
+                classes.update(names)
+            else:
+                ids.update(names)
+        tags.update(t.lower() for t in TAG_RE.findall(template))
+    return classes, ids, tags
+
+
+def _block_end(css, start):
+    """
+    Returns the index after the brace closing the block opened at start
+    """
+    depth, end = 1, start + 1
+    while depth:
+        if css[end] == '{':
+            depth += 1
+        elif css[end] == '}':
+            depth -= 1
+        end += 1
+    return end
+
+
+def parse(css):
+    """
+    Yields the prelude and the body of the top level blocks of the css
+    """
+    css = COMMENT_RE.sub('', css)
+    index = 0
+    start = css.find('{')
+    while start >= 0:
+        # Drop the statements like @charset before the block
+        prelude = css[index:start].rsplit(';', 1)[-1].strip()
+        index = _block_end(css, start)
+        yield prelude, css[start + 1:index - 1]
+        start = css.find('{', index)
+
+
+def is_used(selector, classes, ids, tags):
+    """
+    Returns True if every class, id and element of the selector is used
+    """
+    simple = PSEUDO_RE.sub('', selector)
+    return (
+        set(SELECTOR_CLASS_RE.findall(simple)) <= classes
+        and set(SELECTOR_ID_RE.findall(simple)) <= ids
+        and set(t.lower() for t in SELECTOR_TAG_RE.findall(simple)) <= tags
+    )
+
+
+def purge_selectors(prelude, classes, ids, tags):
+    """
+    Returns the selectors of the rule which can match the used names
+    """
+    return ','.join(
+        s.strip() for s in prelude.split(',')
+        if is_used(s, classes, ids, tags)
+    )
+
+
+def purge(css, classes, ids, tags):
+    """
+    Returns the rules of the css with a selector which can match the used
+    classes, ids and elements. Media queries are purged recursively, the
+    other at-rules (font faces, keyframes) are dropped.
+    """
+    rules = []
+    for prelude, body in parse(css):
+        if prelude.startswith('@media'):
+            body = purge(body, classes, ids, tags)
+        elif prelude.startswith('@'):
+            body = body if prelude.startswith('@page') else None
+        else:
+            prelude = purge_selectors(prelude, classes, ids, tags)
+        if prelude and body:
+            rules.append('%s{%s}' % (prelude, body))
+    return ''.join(rules)
+
+
+def build(directory=DIRECTORY):
+    """
+    Returns the purged stylesheet of the templates of the directory
+    """
+    templates = []
+    for name in sorted(glob.glob(os.path.join(directory, TEMPLATES))):
+        with open(name) as template:
+            templates.append(template.read())
+    classes, ids, tags = used_names(templates)
+
+    stylesheets = []
+    for name in SOURCES:
+        with open(os.path.join(directory, name)) as source:
+            stylesheets.append(purge(source.read(), classes, ids, tags))
+    return (
+        '/* Generated by css_bundle.py from %s, do not edit */\n%s\n' % (
+            ', '.join(os.path.basename(s) for s in SOURCES),
+            '\n'.join(stylesheets),
+        )
+    )
+
+
+_stylesheets = {}
+_stylesheets_lock = threading.Lock()
+
+
+def inline_stylesheet(name):
+    """
+    Jinja global returning the stylesheet of the module path in a style
+    element. The file is only read again when it is modified::
+
+        {{ inline_stylesheet('report_html_stock/reports/css/report.css') }}
+    """
+    with _stylesheets_lock:
+        path, mtime, markup = _stylesheets.get(name, (None, None, None))
+        if path is None or os.path.getmtime(path) != mtime:
+            with file_open(name) as stylesheet:
+                path = stylesheet.name
+                mtime = os.path.getmtime(path)
+                markup = Markup(u'<style type="text/css">%s</style>') % (
+                    Markup(stylesheet.read().decode('utf-8'))
+                )
+            _stylesheets[name] = (path, mtime, markup)
+        return markup
+
+
+if __name__ == '__main__':
+    bundle = build()
+    with open(os.path.join(DIRECTORY, BUNDLE), 'w') as output:
+        output.write(bundle)
+    sys.stderr.write('%s: %d bytes from %d bytes\n' % (
+        BUNDLE, len(bundle), sum(
+            os.path.getsize(os.path.join(DIRECTORY, s)) for s in SOURCES
+        )
+    ))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+    Timing and query counting of the phases of a report execution.
+"""
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from trytond.transaction import Transaction
+
+__all__ = ['ReportStats', 'count_queries']
+
+
+class CountingCursor(object):
+    """
+    Cursor counting the statements executed through it
+    """
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter.queries += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._counter.queries += 1
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class CountingConnection(object):
+    """
+    Connection whose cursors count the statements they execute
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.queries = 0
+
+    def cursor(self, *args, **kwargs):
+        return CountingCursor(
+            self._connection.cursor(*args, **kwargs), self
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the queries executed on the connection of the current
+    transaction while the context is active. Yields the counting
+    connection whose queries attribute holds the count.
+    """
+    transaction = Transaction()
+    connection = transaction.connection
+    if isinstance(connection, CountingConnection):
+        # Already counted by an outer context
+        yield connection
+        return
+
+    transaction.connection = CountingConnection(connection)
+    try:
+        yield transaction.connection
+    finally:
+        transaction.connection = connection
+
+
+class ReportStats(object):
+    """
+    Wall time and number of queries of the phases of a report execution,
+    the size of its output and the number of records.
+
+    Phases are exclusive: the time and queries of a phase nested in
+    another one are only counted in the inner phase.
+    """
+
+    def __init__(self, report, records):
+        self.report = report
+        self.records = records
+        self.durations = OrderedDict()
+        self.queries = OrderedDict()
+        self.html_size = 0
+        self.pdf_size = None
+        self.cache_hit = False
+        self._connection = None
+        self._stack = []
+
+    @contextmanager
+    def collect(self):
+        """
+        Count the queries of the phases run in the context
+        """
+        with count_queries() as connection:
+            self._connection = connection
+            try:
+                yield self
+            finally:
+                self._connection = None
+
+    @contextmanager
+    def phase(self, name):
+        frame = [time.time(), self._query_count(), 0, 0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            duration = time.time() - frame[0]
+            queries = self._query_count() - frame[1]
+            self.durations[name] = (
+                self.durations.get(name, 0) + duration - frame[2]
+            )
+            self.queries[name] = (
+                self.queries.get(name, 0) + queries - frame[3]
+            )
+            if self._stack:
+                self._stack[-1][2] += duration
+                self._stack[-1][3] += queries
+
+    def _query_count(self):
+        if self._connection is None:
+            return 0
+        return self._connection.queries
+
+    @property
+    def duration(self):
+        return sum(self.durations.values())
+
+    @property
+    def total_queries(self):
+        return sum(self.queries.values())
+
+    def as_dict(self):
+        return {
+            'report': self.report,
+            'records': self.records,
+            'durations': self.durations,
+            'queries': self.queries,
+            'duration': self.duration,
+            'total_queries': self.total_queries,
+            'html_size': self.html_size,
+            'pdf_size': self.pdf_size,
+            'cache_hit': self.cache_hit,
+        }
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+    Reports rendered in the background by the cron process, so that large
+    batches do not block the workers serving the clients.
+"""
+import json
+import logging
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from trytond.config import config
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.protocols.jsonrpc import JSONEncoder, JSONDecoder
+from trytond.rpc import RPC
+from trytond.transaction import Transaction
+
+__all__ = ['ReportJob']
+logger = logging.getLogger(__name__)
+
+STATES = {
+    'readonly': True,
+}
+
+
+class ReportJob(ModelSQL, ModelView):
+    "Report Job"
+    __name__ = 'report.job'
+
+    report = fields.Char('Report', required=True, states=STATES)
+    user = fields.Many2One('res.user', 'User', required=True, states=STATES)
+    company = fields.Many2One('company.company', 'Company', states=STATES)
+    language = fields.Char('Language', states=STATES)
+    record_ids = fields.Text('Record IDs', states=STATES)
+    data = fields.Text('Data', states=STATES)
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], 'State', required=True, readonly=True, select=True)
+    started = fields.DateTime('Started', readonly=True)
+    finished = fields.DateTime('Finished', readonly=True)
+    duration = fields.Function(
+        fields.TimeDelta('Duration'), 'get_duration'
+    )
+    error = fields.Text('Error', readonly=True)
+    attachment = fields.Many2One('ir.attachment', 'Output', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(ReportJob, cls).__setup__()
+        cls._order = [
+            ('create_date', 'DESC'),
+            ('id', 'DESC'),
+        ]
+        cls.__rpc__.update({
+            'enqueue': RPC(readonly=False),
+        })
+
+    @staticmethod
+    def default_state():
+        return 'queued'
+
+    def get_duration(self, name):
+        if self.started and self.finished:
+            return self.finished - self.started
+
+    @classmethod
+    def enqueue(cls, report, ids, data):
+        """
+        Queue the report on the ids with the data for the current user and
+        return the id of the job. It is the only way the users create jobs,
+        as the job is run with the access of its user.
+        """
+        transaction = Transaction()
+
+        with transaction.set_context(_check_access=False):
+            job, = cls.create([{
+                'report': report,
+                'user': transaction.user,
+                'company': transaction.context.get('company'),
+                'language': transaction.language,
+                'record_ids': json.dumps(ids),
+                'data': json.dumps(data, cls=JSONEncoder),
+            }])
+        return job.id
+
+    @staticmethod
+    def get_workers():
+        """
+        Returns the maximum number of jobs run at the same time by a cron
+        process::
+
+            [report_html_stock]
+            report_job_workers = 2
+        """
+        return config.getint(
+            'report_html_stock', 'report_job_workers', default=2
+        )
+
+    @staticmethod
+    def get_timeout():
+        """
+        Returns the time after which a running job is considered lost, as
+        when the cron process stopped while running it::
+
+            [report_html_stock]
+            # In seconds
+            report_job_timeout = 3600
+        """
+        return timedelta(seconds=config.getint(
+            'report_html_stock', 'report_job_timeout', default=3600
+        ))
+
+    @classmethod
+    def fail_lost(cls):
+        """
+        Mark as failed the running jobs started before the timeout
+        """
+        jobs = cls.search([
+            ('state', '=', 'running'),
+            ('started', '<', datetime.now() - cls.get_timeout()),
+        ])
+        cls.write(jobs, {
+            'state': 'failed',
+            'finished': datetime.now(),
+            'error': 'The job did not finish before the timeout',
+        })
+
+    @classmethod
+    def claim(cls):
+        """
+        Mark the oldest queued jobs as running, up to the number of workers
+        not running a job yet, and return them
+        """
+        transaction = Transaction()
+        transaction.database.lock(transaction.connection, cls._table)
+
+        cls.fail_lost()
+        workers = cls.get_workers() - cls.search(
+            [('state', '=', 'running')], count=True
+        )
+        if workers <= 0:
+            return []
+        jobs = cls.search([
+            ('state', '=', 'queued'),
+        ], order=[('create_date', 'ASC'), ('id', 'ASC')], limit=workers)
+        cls.write(jobs, {
+            'state': 'running',
+            'started': datetime.now(),
+        })
+        return jobs
+
+    @classmethod
+    def process_queue(cls):
+        """
+        Run the queued jobs, each in its own thread and transaction.
+        It is called by the cron, which does not wait for the jobs so that
+        the other crons of the database are not delayed by the reports.
+        """
+        transaction = Transaction()
+        database_name = transaction.database.name
+
+        jobs = cls.claim()
+        # Make the claim visible to the other cron processes
+        transaction.commit()
+
+        for job in jobs:
+            threading.Thread(
+                target=cls.run_job, args=(database_name, job.id)
+            ).start()
+
+    @classmethod
+    def run_job(cls, database_name, job_id):
+        """
+        Run the job in a new transaction and store the failure in another
+        one if it raises.
+        """
+        with Transaction().start(database_name, 0):
+            job = cls(job_id)
+            user, context = job.user.id, job.get_context()
+
+        try:
+            # Reports are executed in read-only transactions, as when they
+            # are called by the clients
+            with Transaction().start(
+                    database_name, user, context=context, readonly=True):
+                result = cls(job_id).execute()
+            with Transaction().start(database_name, user, context=context):
+                cls(job_id).store(*result)
+        except Exception:
+            logger.error('Report job %s failed', job_id, exc_info=True)
+            with Transaction().start(database_name, 0):
+                cls.write([cls(job_id)], {
+                    'state': 'failed',
+                    'finished': datetime.now(),
+                    'error': traceback.format_exc(),
+                })
+
+    def get_context(self):
+        """
+        Returns the context the report was enqueued with, checking the
+        access rights as for the user calling the report
+        """
+        context = {
+            'language': self.language,
+            '_check_access': True,
+        }
+        if self.company:
+            context['company'] = self.company.id
+        return context
+
+    def run(self):
+        """
+        Execute the report and store its output as an attachment of the job
+        """
+        self.store(*self.execute())
+
+    def execute(self):
+        """
+        Execute the report and return its extension, content and name
+        """
+        Report = Pool().get(self.report, type='report')
+
+        oext, content, _, name = Report.execute(
+            json.loads(self.record_ids),
+            json.loads(self.data, object_hook=JSONDecoder()),
+        )
+        return oext, bytes(content), name
+
+    def store(self, oext, content, name):
+        """
+        Store the output of the report as an attachment of the job and mark
+        it as done
+        """
+        Attachment = Pool().get('ir.attachment')
+
+        # The users can not write the jobs
+        with Transaction().set_context(_check_access=False):
+            attachment, = Attachment.create([{
+                'name': '%s.%s' % (name, oext),
+                'resource': str(self),
+                'data': content,
+            }])
+            self.write([self], {
+                'state': 'done',
+                'finished': datetime.now(),
+                'attachment': attachment.id,
+            })
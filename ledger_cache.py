@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+    Totals of the product ledger buckets per closed month, so that the
+    ledgers over overlapping ranges only sum the moves of the open month
+    and of the months whose done moves changed since.
+"""
+from itertools import chain
+from collections import defaultdict
+from dateutil.relativedelta import relativedelta
+
+from sql import Column
+from sql.functions import CurrentTimestamp
+
+from trytond import backend
+from trytond.model import ModelSQL, ModelView, Unique, fields
+from trytond.pool import Pool
+from trytond.tools import reduce_ids, grouped_slice
+from trytond.transaction import Transaction
+
+__all__ = ['ProductLedgerMonth']
+
+#: The totals stored for each product and month, named as in the summary
+#: of the ledger
+TOTALS = ['purchased', 'produced', 'customer', 'lost', 'consumed']
+
+
+class ProductLedgerMonth(ModelSQL, ModelView):
+    "Product Ledger Month"
+    __name__ = 'product.ledger.month'
+
+    product = fields.Many2One(
+        'product.product', 'Product', required=True, readonly=True,
+        select=True, ondelete='CASCADE'
+    )
+    month = fields.Date('Month', required=True, readonly=True, select=True)
+    purchased = fields.Float('Purchased', readonly=True)
+    produced = fields.Float('Produced', readonly=True)
+    customer = fields.Float('Customer', readonly=True)
+    lost = fields.Float('Lost', readonly=True)
+    consumed = fields.Float('Consumed', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(ProductLedgerMonth, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('product_month_uniq', Unique(t, t.product, t.month),
+                'The totals of a product must be unique per month.'),
+        ]
+        cls._order = [
+            ('month', 'DESC'),
+            ('id', 'DESC'),
+        ]
+
+    @staticmethod
+    def get_closed_months(start_date, end_date):
+        """
+        Returns the first day of the months entirely in the date range and
+        before the current month
+        """
+        Date = Pool().get('ir.date')
+
+        current = Date.today().replace(day=1)
+        month = start_date.replace(day=1)
+        if month < start_date:
+            month += relativedelta(months=1)
+        months = []
+        while (month < current
+                and month + relativedelta(months=1, days=-1) <= end_date):
+            months.append(month)
+            month += relativedelta(months=1)
+        return months
+
+    @classmethod
+    def get_totals(cls, product_ids, months, compute):
+        """
+        Returns the totals of the products for the months, from the cache
+        or computed by compute(product_ids, start_date, end_date) and then
+        stored::
+
+            {month: {product_id: {'purchased': 4.0, ...}}}
+        """
+        rv = cls._read_totals(product_ids, months)
+        missing = cls._missing(rv, dict.fromkeys(months, product_ids))
+        if missing:
+            for month, totals in cls._compute(missing, compute).iteritems():
+                rv[month].update(totals)
+        return rv
+
+    @classmethod
+    def _read_totals(cls, product_ids, months):
+        rv = dict((month, {}) for month in months)
+        for sub_ids in grouped_slice(product_ids):
+            for row in cls.search_read([
+                    ('product', 'in', list(sub_ids)),
+                    ('month', 'in', months),
+                    ], fields_names=['product', 'month'] + TOTALS):
+                rv[row['month']][row['product']] = dict(
+                    (key, row[key] or 0.0) for key in TOTALS
+                )
+        return rv
+
+    @staticmethod
+    def _missing(rv, products):
+        """
+        Returns the products of each month, {month: product_ids}, without
+        totals in rv
+        """
+        missing = {}
+        for month, product_ids in products.iteritems():
+            product_ids = [p for p in product_ids if p not in rv[month]]
+            if product_ids:
+                missing[month] = product_ids
+        return missing
+
+    @classmethod
+    def _compute(cls, missing, compute):
+        """
+        Returns the totals of the missing products of each month, computed
+        in the transaction storing them. The reports are executed in
+        read-only transactions, so it is a short new one which also sees
+        the moves done since the report started, as their invalidation found
+        nothing to delete.
+        """
+        DatabaseOperationalError = backend.get('DatabaseOperationalError')
+        DatabaseIntegrityError = backend.get('DatabaseIntegrityError')
+        transaction = Transaction()
+
+        if not transaction.readonly:
+            # The stored totals are only seen by the others, and by the
+            # invalidation of their moves, once the transaction is committed
+            return cls._compute_store(missing, compute)
+        try:
+            with transaction.new_transaction():
+                return cls._compute_store(missing, compute)
+        except (DatabaseOperationalError, DatabaseIntegrityError):
+            # A concurrent ledger stored the same totals meanwhile
+            return cls._compute_missing(missing, compute)
+
+    @classmethod
+    def _compute_store(cls, missing, compute):
+        product_ids = sorted(set(chain.from_iterable(missing.itervalues())))
+        rv = cls._read_totals(product_ids, missing.keys())
+        computed = cls._compute_missing(cls._missing(rv, missing), compute)
+        cls._insert([
+            (product_id, month, values)
+            for month, totals in computed.iteritems()
+            for product_id, values in totals.iteritems()
+        ])
+        for month, totals in computed.iteritems():
+            rv[month].update(totals)
+        return rv
+
+    @classmethod
+    def _insert(cls, rows):
+        """
+        Insert the totals of the (product_id, month, totals) rows without
+        locking the table, the totals stored twice by concurrent ledgers
+        being rejected by the unique constraint
+        """
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+
+        columns = [
+            table.product, table.month, table.create_uid, table.create_date,
+        ] + [Column(table, name) for name in TOTALS]
+        for sub_rows in grouped_slice(rows):
+            cursor.execute(*table.insert(columns, [
+                [product_id, month, transaction.user, CurrentTimestamp()]
+                + [values.get(name) for name in TOTALS]
+                for product_id, month, values in sub_rows
+            ]))
+
+    @staticmethod
+    def _compute_missing(missing, compute):
+        return dict(
+            (month, compute(
+                product_ids, month, month + relativedelta(months=1, days=-1)
+            ))
+            for month, product_ids in missing.iteritems()
+        )
+
+    @classmethod
+    def invalidate(cls, moves):
+        """
+        Delete the totals of the months of the done moves
+        """
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        products = defaultdict(set)
+        for move in moves:
+            if move.state == 'done' and move.effective_date:
+                month = move.effective_date.replace(day=1)
+                products[month].add(move.product.id)
+        for month, product_ids in products.iteritems():
+            for sub_ids in grouped_slice(product_ids):
+                cursor.execute(*table.delete(
+                    where=(table.month == month)
+                    & reduce_ids(table.product, sub_ids)))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+    Writers of the product ledger rows as CSV, XLSX or JSON Lines. The rows
+    are written one by one as they are produced, to a file which is only
+    kept in memory while it is small.
+"""
+import csv
+import json
+import datetime
+from tempfile import SpooledTemporaryFile
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+__all__ = ['FORMATS', 'export']
+
+#: Size up to which the exported file is kept in memory
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def write_csv(output, columns, rows):
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_text(v) for v in row])
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def write_jsonl(output, columns, rows):
+    for row in rows:
+        output.write(json.dumps(
+            dict(zip(columns, row)), default=_json_default, sort_keys=True
+        ))
+        output.write('\n')
+
+
+def write_xlsx(output, columns, rows):
+    """
+    Write the rows with xlsxwriter in constant memory mode, which flushes
+    each row to a temporary file once the next one is started.
+    """
+    if xlsxwriter is None:
+        raise Exception('Error', 'xlsxwriter is required to export XLSX')
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    worksheet = workbook.add_worksheet()
+    worksheet.write_row(0, 0, columns)
+    for index, row in enumerate(rows, 1):
+        for column, value in enumerate(row):
+            if isinstance(value, datetime.date):
+                worksheet.write_datetime(index, column, value, date_format)
+            else:
+                worksheet.write(index, column, value)
+    workbook.close()
+
+
+#: The writers of each format, called with the output file, the names of
+#: the columns and the iterable of rows
+FORMATS = {
+    'csv': write_csv,
+    'xlsx': write_xlsx,
+    'jsonl': write_jsonl,
+}
+
+
+def export(rows, columns, format_):
+    """
+    Returns the content of the rows written in the format
+    """
+    with SpooledTemporaryFile(max_size=SPOOL_SIZE) as output:
+        FORMATS[format_](output, columns, rows)
+        output.seek(0)
+        return output.read()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    Bounded on-disk cache of rendered reports.
+
+    Entries are files named after their key. Reading an entry touches its
+    modification time, so the oldest files are the least recently used and
+    are removed first when the cache grows beyond its size.
+"""
+import os
+import tempfile
+import threading
+
+from trytond.config import config
+
+__all__ = ['DiskCache', 'get_cache']
+
+
+class DiskCache(object):
+    """
+    Files stored in a directory, evicted in least recently used order once
+    their total size exceeds max_size bytes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file_name(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        """
+        Returns the content stored under the key or None
+        """
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, 'rb') as cache_file:
+                content = cache_file.read()
+            os.utime(file_name, None)
+        except (IOError, OSError):
+            # Missing or evicted by another process
+            return None
+        return content
+
+    def set(self, key, content):
+        """
+        Store the content under the key and evict the least recently used
+        entries
+        """
+        # Write to a temporary file first so that readers never see a
+        # partial entry
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(content)
+        os.rename(tmp_name, self._file_name(key))
+        self.evict()
+
+    def entries(self):
+        """
+        Returns (mtime, size, file name) of the entries
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if name.startswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(self._file_name(name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(e[1] for e in entries)
+            while entries and total > self.max_size:
+                _, size, name = entries.pop(0)
+                try:
+                    os.remove(self._file_name(name))
+                except OSError:
+                    pass
+                total -= size
+
+    def clear(self):
+        for _, _, name in self.entries():
+            try:
+                os.remove(self._file_name(name))
+            except OSError:
+                pass
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the cache of rendered reports, or None if it is not enabled in
+    the configuration::
+
+        [report_html_stock]
+        pdf_cache_path = /var/cache/trytond/reports
+        pdf_cache_size = 256
+    """
+    path = config.get('report_html_stock', 'pdf_cache_path')
+    if not path:
+        return None
+
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = DiskCache(
+                path,
+                config.getint(
+                    'report_html_stock', 'pdf_cache_size', default=256
+                ) * 1024 * 1024,
+            )
+        return _caches[path]
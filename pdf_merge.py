@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+    Conversion of a report split in chunks of html documents, converted to
+    pdf in parallel and concatenated.
+"""
+import re
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+try:
+    import PyPDF2
+    from PyPDF2.generic import DecodedStreamObject, DictionaryObject, \
+        NameObject
+except ImportError:
+    PyPDF2 = None
+
+__all__ = ['count_pages', 'merge', 'convert_chunks']
+
+#: wkhtmltopdf header and footer variables which depend on the page count
+#: of the whole document
+PAGE_VARIABLES = ('[page]', '[toPage]', '[topage]')
+
+#: The header and footer texts which can be stamped on the merged document
+STAMPED_OPTIONS = [
+    '%s-%s' % (place, align)
+    for place in ('header', 'footer')
+    for align in ('left', 'center', 'right')
+]
+
+#: Points per unit of the wkhtmltopdf margins
+UNITS = {
+    'in': 72.0,
+    'cm': 72 / 2.54,
+    'mm': 72 / 25.4,
+    'pt': 1.0,
+}
+
+#: Width of the Helvetica characters per point of font size, the default
+#: being the width of the digits
+NARROW_CHARACTERS = {' ': 0.278, '/': 0.278, '.': 0.278, ':': 0.278}
+CHARACTER_WIDTH = 0.556
+
+
+def _require_pypdf2():
+    if PyPDF2 is None:
+        raise Exception('Error', 'PyPDF2 is required to merge PDF documents')
+
+
+def count_pages(data):
+    """
+    Returns the number of pages of the pdf document
+    """
+    _require_pypdf2()
+    return PyPDF2.PdfFileReader(BytesIO(data)).getNumPages()
+
+
+def merge(documents, stamps=None, options=None):
+    """
+    Returns the concatenation of the pdf documents, with the page numbers
+    of the stamps texts, {option: text}, stamped on each page
+    """
+    _require_pypdf2()
+    readers = [PyPDF2.PdfFileReader(BytesIO(data)) for data in documents]
+    pages = [
+        reader.getPage(index)
+        for reader in readers for index in range(reader.getNumPages())
+    ]
+    writer = PyPDF2.PdfFileWriter()
+    for number, page in enumerate(pages, 1):
+        if stamps:
+            stamp_page(page, stamps, options or {}, number, len(pages))
+        writer.addPage(page)
+    result = BytesIO()
+    writer.write(result)
+    return result.getvalue()
+
+
+def is_numbered(options):
+    """
+    Returns True if the headers or footers of the options show page numbers
+    """
+    return any(
+        variable in value
+        for value in options.values() if isinstance(value, basestring)
+        for variable in PAGE_VARIABLES
+    )
+
+
+def split_numbered(options):
+    """
+    Returns the options without the header and footer texts showing page
+    numbers, and these texts::
+
+        ({option: value}, {option: text})
+    """
+    stamps = dict(
+        (option, options[option]) for option in STAMPED_OPTIONS
+        if option in options and is_numbered({option: options[option]})
+    )
+    return dict(
+        (option, value) for option, value in options.iteritems()
+        if option not in stamps
+    ), stamps
+
+
+def page_text(text, number, total):
+    """
+    Returns the text with the page variables of the page number of total
+    """
+    return text.replace('[page]', str(number)).replace(
+        '[toPage]', str(total)
+    ).replace('[topage]', str(total))
+
+
+def to_points(value, default):
+    """
+    Returns the wkhtmltopdf length in points, millimeters by default
+    """
+    match = re.match(r'^\s*([\d.]+)\s*([a-z]*)\s*$', str(value or ''))
+    if not match:
+        return default
+    number, unit = match.groups()
+    return float(number) * UNITS.get(unit, UNITS['mm'])
+
+
+def text_width(text, size):
+    return size * sum(
+        NARROW_CHARACTERS.get(character, CHARACTER_WIDTH)
+        for character in text
+    )
+
+
+def text_position(option, text, options, width, height):
+    """
+    Returns the font size and the origin of the text of the header or
+    footer option on a page of width and height, laid out as wkhtmltopdf
+    does within the margins
+    """
+    place, align = option.split('-')
+    size = float(options.get('%s-font-size' % place) or 12)
+    spacing = to_points(options.get('%s-spacing' % place), 0.0)
+    left = to_points(options.get('margin-left'), 10 * UNITS['mm'])
+    right = to_points(options.get('margin-right'), 10 * UNITS['mm'])
+    x = {
+        'left': left,
+        'center': (width - text_width(text, size)) / 2,
+        'right': width - right - text_width(text, size),
+    }[align]
+    if place == 'footer':
+        y = to_points(options.get('margin-bottom'), 10 * UNITS['mm']) \
+            - spacing - size
+    else:
+        y = height - to_points(options.get('margin-top'), 10 * UNITS['mm']) \
+            + spacing
+    return size, x, y
+
+
+def _pdf_string(text):
+    if isinstance(text, unicode):
+        text = text.encode('latin-1', 'replace')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def stamp_page(page, stamps, options, number, total):
+    """
+    Stamps the stamps texts, {option: text}, of the page number of total
+    on the page in Helvetica
+    """
+    width = float(page.mediaBox.getWidth())
+    height = float(page.mediaBox.getHeight())
+    content = []
+    for option, text in sorted(stamps.iteritems()):
+        text = page_text(text, number, total)
+        size, x, y = text_position(option, text, options, width, height)
+        content.append('BT /F1 %.2f Tf %.2f %.2f Td (%s) Tj ET' % (
+            size, x, y, _pdf_string(text)
+        ))
+    stream = DecodedStreamObject()
+    stream.setData('\n'.join(content))
+    overlay = PyPDF2.PdfFileWriter().addBlankPage(width, height)
+    overlay[NameObject('/Contents')] = stream
+    overlay[NameObject('/Resources')] = DictionaryObject({
+        NameObject('/Font'): DictionaryObject({
+            NameObject('/F1'): DictionaryObject({
+                NameObject('/Type'): NameObject('/Font'),
+                NameObject('/Subtype'): NameObject('/Type1'),
+                NameObject('/BaseFont'): NameObject('/Helvetica'),
+            }),
+        }),
+    })
+    page.mergePage(overlay)
+
+
+def convert_chunks(documents, options, convert, workers):
+    """
+    Converts the html documents with convert(data, options) on workers
+    threads and returns the concatenated pdf.
+
+    Each document is submitted as soon as it is produced by the iterable,
+    so the conversion of the first chunks overlaps the rendering of the
+    next ones. The page count of the whole document is only known once
+    every chunk is converted, so the headers and footers showing page
+    numbers are left out of the conversion and stamped on the merged
+    document instead.
+    """
+    options, stamps = split_numbered(options)
+    pool = ThreadPool(workers)
+    try:
+        results = [
+            pool.apply_async(convert, (data, options)) for data in documents
+        ]
+        pdfs = [r.get() for r in results]
+    finally:
+        pool.close()
+        pool.join()
+    if len(pdfs) == 1 and not stamps:
+        return pdfs[0]
+    return merge(pdfs, stamps, options)
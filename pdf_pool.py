@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+    Pool of long-lived wkhtmltopdf processes.
+
+    Each worker runs ``wkhtmltopdf --read-args-from-stdin`` which converts
+    one document per line of arguments written to its standard input, so
+    the cost of starting WebKit is paid once per worker instead of once
+    per report.
+"""
+import os
+import Queue
+import logging
+import tempfile
+import threading
+from subprocess import Popen, PIPE
+
+from trytond.config import config
+
+__all__ = ['PoolTimeout', 'RenderError', 'WorkerPool', 'get_pool']
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """
+    No worker became available within the queue timeout.
+    """
+
+
+class RenderError(Exception):
+    """
+    The worker failed to convert the document.
+    """
+
+
+def quote(value):
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def is_start(line):
+    """
+    Returns True if the line of wkhtmltopdf feedback starts a job
+    """
+    return 'Loading pages' in line
+
+
+def is_error(line):
+    """
+    Returns True if the line of wkhtmltopdf feedback reports that the job
+    failed, which is printed before its Done
+    """
+    return line.startswith('Error:')
+
+
+def exit_code(line):
+    """
+    Returns the exit code of the job from a line of wkhtmltopdf feedback,
+    or None if the line does not end the job.
+    """
+    if 'Exit with code' in line:
+        return int(line.split('Exit with code')[1].split()[0])
+    if line.rstrip().endswith('Done'):
+        return 0
+
+
+class Worker(object):
+    """
+    A wkhtmltopdf process reading conversion jobs from its standard input.
+    """
+    command = ['wkhtmltopdf', '--read-args-from-stdin']
+
+    def __init__(self):
+        self.jobs = 0
+        self.process = Popen(
+            self.command,
+            stdin=PIPE, stdout=open(os.devnull, 'w'), stderr=PIPE,
+        )
+        # The progress of every job is reported on stderr, read it in a
+        # thread so that a job can wait for its end with a timeout.
+        self.feedback = Queue.Queue()
+        reader = threading.Thread(target=self._read_feedback)
+        reader.daemon = True
+        reader.start()
+
+    def _read_feedback(self):
+        for line in iter(self.process.stderr.readline, ''):
+            self.feedback.put(line)
+        self.feedback.put(None)
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def _next_line(self, timeout):
+        try:
+            line = self.feedback.get(timeout=timeout)
+        except Queue.Empty:
+            raise RenderError('wkhtmltopdf timed out')
+        if line is None:
+            raise RenderError('wkhtmltopdf exited unexpectedly')
+        return line
+
+    def _wait(self, timeout):
+        """
+        Wait for the end of the current job and return its exit code.
+
+        The jobs are run one after the other, so the lines before the start
+        of the job, like the exit line wkhtmltopdf prints after the Done of
+        a job on load errors, belong to the previous one. An error before
+        the Done of the job fails it.
+        """
+        self._skip_previous(timeout)
+        failed, code = False, None
+        while code is None:
+            line = self._next_line(timeout)
+            failed = failed or is_error(line)
+            code = exit_code(line)
+        if failed and not code:
+            return 1
+        return code
+
+    def _skip_previous(self, timeout):
+        """
+        Skip the feedback of the previous job until the start of the
+        current one
+        """
+        line = self._next_line(timeout)
+        while not is_start(line):
+            if exit_code(line):
+                logger.warning('wkhtmltopdf: %s', line.strip())
+            line = self._next_line(timeout)
+
+    def convert(self, data, options, timeout=None):
+        """
+        Convert the html to pdf with the given wkhtmltopdf options
+        """
+        with tempfile.NamedTemporaryFile(
+                suffix='.html', prefix='trytond_', delete=False
+        ) as source_file:
+            source_file.write(data)
+        file_name = source_file.name
+        try:
+            args = []
+            for option, value in options.items():
+                args.append('--%s' % option)
+                if value:
+                    args.append(quote(value))
+            args.extend([file_name, file_name + '.pdf'])
+
+            self.jobs += 1
+            self.process.stdin.write(' '.join(args) + '\n')
+            self.process.stdin.flush()
+            code = self._wait(timeout)
+            if code != 0 or not os.path.exists(file_name + '.pdf'):
+                raise RenderError('wkhtmltopdf exited with code %s' % code)
+            with open(file_name + '.pdf', 'rb') as pdf_file:
+                return pdf_file.read()
+        finally:
+            for name in (file_name, file_name + '.pdf'):
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def close(self):
+        if self.alive:
+            self.process.stdin.close()
+            self.process.kill()
+            self.process.wait()
+
+
+class WorkerPool(object):
+    """
+    A fixed number of slots, each holding a started worker or None until
+    a worker is needed. Workers are recycled after max_jobs conversions.
+    """
+
+    def __init__(self, size, max_jobs=None, queue_timeout=None,
+                 job_timeout=None):
+        self.max_jobs = max_jobs
+        self.queue_timeout = queue_timeout
+        self.job_timeout = job_timeout
+        self.slots = Queue.Queue()
+        for i in range(size):
+            self.slots.put(None)
+
+    def acquire(self):
+        try:
+            worker = self.slots.get(timeout=self.queue_timeout)
+        except Queue.Empty:
+            raise PoolTimeout('No wkhtmltopdf worker available')
+        if worker is None or not worker.alive:
+            worker = self._start_worker()
+        return worker
+
+    def _start_worker(self):
+        try:
+            return Worker()
+        except Exception:
+            # Give the slot back
+            self.slots.put(None)
+            raise
+
+    def release(self, worker):
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            worker.close()
+            worker = None
+        self.slots.put(worker)
+
+    def convert(self, data, options):
+        """
+        Convert the html to pdf on the first available worker
+        """
+        worker = self.acquire()
+        try:
+            return worker.convert(data, options, self.job_timeout)
+        except Exception:
+            # The process state is unknown after a failure, start a new
+            # one for the next job.
+            worker.close()
+            raise
+        finally:
+            self.release(worker)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the worker pool of the current process, or None if the pool is
+    not enabled in the configuration::
+
+        [report_html_stock]
+        pdf_workers = 4
+        pdf_worker_max_jobs = 100
+        pdf_queue_timeout = 60
+        pdf_job_timeout = 300
+    """
+    size = config.getint('report_html_stock', 'pdf_workers', default=0)
+    if not size:
+        return None
+
+    # Processes can not be shared with forked server processes
+    pid = os.getpid()
+    with _pools_lock:
+        if pid not in _pools:
+            _pools[pid] = WorkerPool(
+                size,
+                max_jobs=config.getint(
+                    'report_html_stock', 'pdf_worker_max_jobs', default=100
+                ),
+                queue_timeout=config.getfloat(
+                    'report_html_stock', 'pdf_queue_timeout', default=60
+                ),
+                job_timeout=config.getfloat(
+                    'report_html_stock', 'pdf_job_timeout', default=300
+                ),
+            )
+        return _pools[pid]
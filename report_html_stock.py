@@ -1,20 +1,81 @@
 # -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import inspect
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from multiprocessing import cpu_count
 from itertools import groupby, imap, chain
 from dateutil.relativedelta import relativedelta
+from jinja2 import Markup, Template
+from sql import Null, Cast
+from sql.aggregate import Sum
+from sql.conditionals import Case, Coalesce
+from sql.functions import Position, Substring
+from sql.operators import Concat
 
 from trytond.pool import Pool, PoolMeta
-from trytond.model import fields, ModelView
+from trytond.model import fields, Model, ModelView
 from trytond.wizard import Wizard, Button, StateAction, StateView
+from trytond.report import Report
+from trytond.exceptions import UserError
+from trytond.tools import reduce_ids, file_open, grouped_slice
+from trytond.config import config
 from trytond.transaction import Transaction
 
 from openlabs_report_webkit import ReportWebkit
 
+from pdf_pool import get_pool
+from pdf_cache import get_cache
+from pdf_merge import convert_chunks
+from barcodes import barcode
+from css_bundle import inline_stylesheet
+from instrumentation import ReportStats
+from ledger_export import export
+
 __all__ = [
     'PickingList', 'SupplierRestockingList', 'CustomerReturnRestockingList',
     'ConsolidatedPickingList', 'ProductLedgerStartView', 'ProductLedgerReport',
     'ProductLedger', 'InternalShipmentReport'
 ]
 __metaclass__ = PoolMeta
+logger = logging.getLogger(__name__)
+
+#: Set in the thread resolving the options of wkhtml_to_pdf for the chunks
+_resolving = threading.local()
+
+
+class ResolvedOptions(Exception):
+    """
+    Raised by wkhtml_to_pdf with its final options instead of converting
+    while they are resolved for the chunks
+    """
+
+    def __init__(self, options):
+        super(ResolvedOptions, self).__init__()
+        self.options = options
+
+
+class CompanyFragment(Template):
+    """
+    Template of a rendered company header or footer: it prints the cached
+    markup both with ``{{ header }}`` and ``{% include header %}``.
+    """
+
+    @classmethod
+    def create(cls, env, markup):
+        template = env.from_string(u'', template_class=cls)
+        template.markup = markup
+        template.root_render_func = lambda context: iter([markup])
+        return template
+
+    def __html__(self):
+        return self.markup
+
+    def __unicode__(self):
+        return unicode(self.markup)
 
 
 class ReportMixin(ReportWebkit):
@@ -22,17 +83,336 @@ class ReportMixin(ReportWebkit):
     Mixin Class to inherit from, for all HTML reports.
     """
 
+    #: Dotted paths of the fields read by the template from the records.
+    #: They are loaded for all the records at once before rendering.
+    prefetch_fields = []
+
+    #: One2Many fields of the records whose targets are part of the key of
+    #: the cache of rendered reports, along with the records. None disables
+    #: the cache for the report.
+    cache_fields = None
+
+    #: Whether every record is rendered on its own pages, so that large
+    #: batches can be rendered and converted to pdf in chunks
+    chunked = False
+
+    @classmethod
+    def execute(cls, ids, data):
+        """
+        Execute the report, recording the time and queries of its phases
+        """
+        stats = ReportStats(cls.__name__, len(ids or []))
+        with stats.collect(), stats.phase('execute'):
+            cls.check_access()
+            action_report = cls.get_action_report(data)
+            result = cls.execute_cached(action_report, ids, data, stats)
+        if result[0] == 'pdf' and not Pool.test:
+            stats.pdf_size = len(result[1])
+        cls.log_stats(stats)
+        return result
+
+    @classmethod
+    def log_stats(cls, stats):
+        """
+        Log the statistics of the execution and store them when enabled
+        in the configuration::
+
+            [report_html_stock]
+            report_statistics = True
+        """
+        logger.info('report stats %s', json.dumps(
+            stats.as_dict(), sort_keys=True
+        ))
+        if config.getboolean(
+                'report_html_stock', 'report_statistics', default=False):
+            Statistic = Pool().get('report.statistic')
+            # Reports are executed in read-only transactions
+            with Transaction().new_transaction():
+                Statistic.create_from_stats([stats])
+
+    @classmethod
+    def execute_cached(cls, action_report, ids, data, stats):
+        """
+        Returns the report from the cache of rendered reports when the
+        records, their cache_fields and the template did not change since
+        it was rendered.
+        """
+        cache = get_cache()
+        if cache is None or cls.cache_fields is None:
+            return cls.execute_uncached(action_report, ids, data, stats)
+
+        with stats.phase('cache'):
+            key = cls.get_cache_key(action_report, ids, data)
+            content = cache.get(key)
+        if content is not None:
+            stats.cache_hit = True
+            return (
+                action_report.extension or action_report.template_extension,
+                bytearray(content), action_report.direct_print,
+                action_report.name
+            )
+        result = cls.execute_uncached(action_report, ids, data, stats)
+        if not isinstance(result[1], unicode):
+            with stats.phase('cache'):
+                cache.set(key, bytes(result[1]))
+        return result
+
+    @classmethod
+    def execute_uncached(cls, action_report, ids, data, stats):
+        chunk_size = cls.get_chunk_size(action_report, ids)
+        if chunk_size is None:
+            return cls.execute_single(action_report, ids, data, stats)
+        return cls.execute_chunked(
+            action_report, ids, data, chunk_size, stats
+        )
+
+    @classmethod
+    def get_chunk_size(cls, action_report, ids):
+        """
+        Returns the number of records rendered per chunk, or None if the
+        report is rendered as a single document
+        """
+        chunk_size = config.getint(
+            'report_html_stock', 'pdf_chunk_size', default=0
+        )
+        output_format = (
+            action_report.extension or action_report.template_extension
+        )
+        if (not cls.chunked or not chunk_size or len(ids) <= chunk_size
+                or output_format != 'pdf' or Pool.test):
+            return None
+        return chunk_size
+
+    @classmethod
+    def execute_single(cls, action_report, ids, data, stats):
+        """
+        Renders the records as a single document
+        """
+        model = action_report.model or data.get('model')
+        records = None
+        if model:
+            records = cls._get_records(ids, model, data)
+        html = cls.render_chunk(action_report, records, data, stats)
+        with stats.phase('convert'):
+            oext, content = cls.convert(action_report, html)
+        if not isinstance(content, unicode):
+            content = bytearray(content)
+        return (oext, content, action_report.direct_print, action_report.name)
+
+    @classmethod
+    def execute_chunked(cls, action_report, ids, data, chunk_size, stats):
+        """
+        Renders the records chunk by chunk and converts the chunks to pdf in
+        parallel, returning the concatenated document
+        """
+        options = cls.get_chunk_options()
+        if options is None:
+            return cls.execute_single(action_report, ids, data, stats)
+        model = action_report.model or data.get('model')
+        documents = (
+            cls.render_chunk(action_report, cls._get_records(
+                list(sub_ids), model, data
+            ), data, stats)
+            for sub_ids in grouped_slice(ids, chunk_size)
+        )
+        with stats.phase('convert'):
+            content = convert_chunks(
+                documents, options, cls.convert_pdf,
+                config.getint(
+                    'report_html_stock', 'pdf_chunk_workers',
+                    default=cpu_count()
+                )
+            )
+        return (
+            'pdf', bytearray(content), action_report.direct_print,
+            action_report.name
+        )
+
+    @classmethod
+    def render_chunk(cls, action_report, records, data, stats):
+        """
+        Returns the html of the records
+        """
+        with stats.phase('context'):
+            report_context = cls.get_context(records, data)
+        with stats.phase('render'):
+            html = cls.render(action_report, report_context)
+        stats.html_size += len(html)
+        return html
+
+    @classmethod
+    def get_action_report(cls, data):
+        """
+        Returns the action report executed with the data
+        """
+        ActionReport = Pool().get('ir.action.report')
+
+        if data.get('action_id') is not None:
+            return ActionReport(data['action_id'])
+        action_report, = ActionReport.search([
+            ('report_name', '=', cls.__name__)
+        ], limit=1)
+        return action_report
+
+    @classmethod
+    def get_cache_key(cls, action_report, ids, data):
+        """
+        Returns the key of the report in the cache of rendered reports
+        """
+        Model = Pool().get(action_report.model or data['model'])
+        transaction = Transaction()
+
+        # The cache directory may be shared by several databases with the
+        # same ids, like a restored copy
+        key = [
+            transaction.database.name,
+            cls.__name__, action_report.id, action_report.write_date,
+            cls.get_template_mtime(action_report),
+            transaction.language, transaction.context.get('company'),
+            sorted(data.items()),
+            cls.get_write_dates(Model, ids, cls.cache_fields),
+        ]
+        return hashlib.sha1(repr(key)).hexdigest()
+
+    @classmethod
+    def get_template_mtime(cls, action_report):
+        """
+        Returns the modification time of the template file of the report
+        """
+        if not action_report.report:
+            return None
+        with file_open(action_report.report) as template:
+            return os.path.getmtime(template.name)
+
+    @staticmethod
+    def get_write_dates(Model, ids, field_names):
+        """
+        Returns the creation and write dates of the records and of the
+        targets of their field_names, read in bulk
+        """
+        pool = Pool()
+
+        rows = Model.read(ids, ['create_date', 'write_date'] + field_names)
+        write_dates = [(Model.__name__, rows)]
+        for name in field_names:
+            Target = pool.get(Model._fields[name].model_name)
+            target_ids = sorted(set(chain(*(r[name] for r in rows))))
+            write_dates.append((name, Target.read(
+                target_ids, ['create_date', 'write_date']
+            )))
+        return [
+            (model, [(r['id'], r['create_date'], r['write_date']) for r in rs])
+            for model, rs in write_dates
+        ]
+
+    @classmethod
+    def get_context(cls, records, data):
+        report_context = super(ReportMixin, cls).get_context(records, data)
+        if records:
+            cls.prefetch(records, cls.get_prefetch_fields(records, data))
+        return report_context
+
+    @classmethod
+    def get_prefetch_fields(cls, records, data):
+        """
+        Returns the field paths to prefetch on the records
+        """
+        return cls.prefetch_fields
+
+    @classmethod
+    def render_template(cls, template_string, localcontext, translator):
+        """
+        Render the template using Jinja2, encoding the output as it is
+        generated instead of rendering the whole document first.
+        """
+        env = cls.get_environment()
+
+        def renderer(name):
+            return lambda company: env.from_string(
+                getattr(company, '%s_html' % name) or ''
+            ).render(company=company, language=Transaction().language)
+
+        # The header and footer are rendered once per company and language
+        # for every report, so they only get these variables
+        for name in ('header', 'footer'):
+            localcontext[name] = CompanyFragment.create(env, Markup(
+                cls.get_company_fragment(name, renderer(name))
+            ))
+        report_template = env.from_string(template_string.decode('utf-8'))
+        return ''.join(
+            chunk.encode('utf-8')
+            for chunk in report_template.generate(**localcontext)
+        )
+
+    @classmethod
+    def prefetch(cls, records, paths):
+        """
+        Walk the field paths on the records level by level, so that every
+        field is read once for all the records of a level and kept in the
+        caches of the records the template renders.
+        """
+        for path in paths:
+            instances = records
+            for name in path.split('.'):
+                instances = cls._prefetch_field(instances, name)
+
+    @staticmethod
+    def _prefetch_field(instances, name):
+        """
+        Returns the distinct records referenced by the field of the instances
+        """
+        related = OrderedDict()
+        for instance in instances:
+            if name not in instance._fields:
+                continue
+            value = getattr(instance, name)
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+            related.update(
+                ((r.__name__, r.id), r) for r in value
+                if isinstance(r, Model)
+            )
+        return related.values()
+
     @classmethod
     def wkhtml_to_pdf(cls, data, options=None):
         """
-        Call wkhtmltopdf to convert the html to pdf
+        Call wkhtmltopdf to convert the html to pdf, on a worker of the pool
+        of long-lived wkhtmltopdf processes when it is enabled.
         """
-        Company = Pool().get('company.company')
+        opts = cls.get_pdf_options()
+        if options:
+            opts.update(options)
+        if getattr(_resolving, 'options', False):
+            raise ResolvedOptions(opts)
+        return cls.convert_pdf(data, opts)
 
-        company = ''
-        if Transaction().context.get('company'):
-            company = Company(Transaction().context.get('company')).party.name
-        opts = {
+    @classmethod
+    def get_chunk_options(cls):
+        """
+        Returns the options wkhtml_to_pdf converts with, including those
+        added by its overrides, for the chunks converted by convert_pdf in
+        other threads, or None if an override does not convert with them
+        """
+        _resolving.options = True
+        try:
+            cls.wkhtml_to_pdf('')
+        except ResolvedOptions, resolved:
+            return resolved.options
+        finally:
+            _resolving.options = False
+        # An override of wkhtml_to_pdf converting by itself
+        return None
+
+    @classmethod
+    def get_pdf_options(cls):
+        """
+        Returns the default wkhtmltopdf options of the report
+        """
+        company = cls.get_company_fragment(
+            'name', lambda company: company.party.name
+        )
+        return {
             'margin-bottom': '0.50in',
             'margin-left': '0.50in',
             'margin-right': '0.50in',
@@ -44,22 +424,112 @@ class ReportMixin(ReportWebkit):
             'footer-spacing': '5',
             "page-size": "Letter"
         }
-        if options:
-            opts.update(options)
+
+    @staticmethod
+    def get_company_fragment(name, render):
+        """
+        Returns the fragment of the company of the context. It is computed
+        with render(company) once per company and language and cached until
+        the company or its party is written.
+        """
+        pool = Pool()
+        Company = pool.get('company.company')
+        transaction = Transaction()
+
+        company_id = transaction.context.get('company')
+        if not company_id:
+            return u''
+        key = (company_id, transaction.language, name)
+        fragment = Company._report_fragments_cache.get(key)
+        if fragment is None:
+            fragment = render(Company(company_id))
+            Company._report_fragments_cache.set(key, fragment)
+        return fragment
+
+    @classmethod
+    def convert_pdf(cls, data, options):
+        """
+        Convert the html to pdf with the given options. It does not use the
+        transaction, so it can be called from other threads.
+        """
+        pool = get_pool()
+        if pool is not None:
+            return pool.convert(data, options)
         return super(ReportMixin, cls).wkhtml_to_pdf(
-            data, options=opts
+            data, options=options
+        )
+
+    @classmethod
+    def get_jinja_filters(cls):
+        """
+        Add the barcode filter which renders barcodes as inline SVG
+        """
+        filters = super(ReportMixin, cls).get_jinja_filters()
+        filters['barcode'] = barcode
+        return filters
+
+    @classmethod
+    def get_environment(cls):
+        """
+        Add the inline_stylesheet global which inlines a stylesheet read
+        once per modification
+        """
+        env = super(ReportMixin, cls).get_environment()
+        env.globals['inline_stylesheet'] = inline_stylesheet
+        return env
+
+    @classmethod
+    def get_sort_keys(cls, moves, paths):
+        """
+        Returns a dictionary of move id to the tuple of the values of the
+        field paths of the move, read in bulk for all the moves. A path is
+        a field of the move or a field of the record it points to, like
+        ``from_location.rec_name``.
+        """
+        Move = Pool().get('stock.move')
+
+        move_ids = list(set(m.id for m in moves))
+        rows = Move.read(
+            move_ids, list(set(p.split('.', 1)[0] for p in paths))
+        )
+        columns = [cls._read_path(Move, rows, path) for path in paths]
+        return dict(
+            (move_id, tuple(c[move_id] for c in columns))
+            for move_id in move_ids
+        )
+
+    @staticmethod
+    def _read_path(Model, rows, path):
+        """
+        Returns a dictionary of row id to the value of the field path
+        """
+        name, _, target_name = path.partition('.')
+        values = dict((r['id'], r[name]) for r in rows)
+        if not target_name:
+            return values
+
+        Target = Model._fields[name].get_target()
+        targets = dict(
+            (t['id'], t[target_name]) for t in Target.read(
+                list(set(v for v in values.itervalues() if v is not None)),
+                [target_name]
+            )
         )
+        return dict((k, targets.get(v)) for k, v in values.iteritems())
 
     @classmethod
     def get_sorted_moves(cls, records):
         """
         Sorting the moves for each shipment
         """
+        sort_keys = cls.get_sort_keys(
+            list(chain(*(s.inventory_moves for s in records))),
+            ['from_location', 'to_location']
+        )
         sorted_moves = {}
         for shipment in records:
             sorted_moves[shipment.id] = sorted(
-                shipment.inventory_moves,
-                key=lambda m: (m.from_location, m.to_location)
+                shipment.inventory_moves, key=lambda m: sort_keys[m.id]
             )
         return sorted_moves
 
@@ -70,6 +540,24 @@ class PickingList(ReportMixin):
     """
     __name__ = 'report.picking_list'
 
+    cache_fields = ['moves']
+    chunked = True
+
+    prefetch_fields = [
+        'customer.lang',
+        'delivery_address.full_address',
+        'warehouse.rec_name',
+        'weight_uom.symbol',
+        'inventory_moves.product.code',
+        'inventory_moves.uom.symbol',
+        'inventory_moves.from_location.rec_name',
+        'inventory_moves.to_location.rec_name',
+    ]
+
+    #: Field paths of the moves the inventory moves are sorted on, after
+    #: the rank of their location on the pick path of the warehouse
+    sort_key_fields = ['product.name']
+
     @staticmethod
     def sort_inventory_moves(shipment, sort_key=None):
         """
@@ -77,13 +565,34 @@ class PickingList(ReportMixin):
         """
         return sorted(shipment.inventory_moves, key=sort_key)
 
+    @classmethod
+    def get_pick_path_sort_keys(cls, records):
+        """
+        Returns a dictionary of move id to the sort key of the inventory
+        moves of the shipments: the rank of the location on the pick path
+        followed by the values of sort_key_fields.
+        """
+        Location = Pool().get('stock.location')
+
+        keys = cls.get_sort_keys(
+            list(chain(*(s.inventory_moves for s in records))),
+            ['from_location'] + cls.sort_key_fields
+        )
+        sort_keys = {}
+        for shipment in records:
+            ranks = Location.get_pick_ranks(shipment.warehouse.id)
+            for move in shipment.inventory_moves:
+                key = keys[move.id]
+                sort_keys[move.id] = (ranks.get(key[0]),) + key[1:]
+        return sort_keys
+
     @classmethod
     def get_context(cls, records, data):
         report_context = super(PickingList, cls).get_context(records, data)
+        sort_keys = cls.get_pick_path_sort_keys(records)
         report_context['sort_inventory_moves'] = cls.sort_inventory_moves
-        report_context['sort_key'] = lambda move: (
-            move.from_location.rec_name, move.product.name
-        )
+        report_context['sort_keys'] = sort_keys
+        report_context['sort_key'] = lambda move: sort_keys[move.id]
         return report_context
 
 
@@ -93,6 +602,24 @@ class ConsolidatedPickingList(ReportMixin):
     """
     __name__ = 'report.consolidated_picking_list'
 
+    cache_fields = ['moves']
+
+    #: Field paths read by the template from the moves
+    move_prefetch_fields = [
+        'product.rec_name',
+        'product.default_uom.symbol',
+        'uom.symbol',
+        'from_location.rec_name',
+        'shipment.customer.lang',
+        'sale_order.reference',
+    ]
+    prefetch_fields = ['inventory_moves.' + f for f in move_prefetch_fields]
+
+    #: Number of shipments from which the moves are streamed from the
+    #: database one group at a time instead of being loaded and sorted
+    #: together. It can be forced with the ``stream`` key of the data.
+    stream_threshold = 500
+
     @classmethod
     def group_key(cls, move):
         """
@@ -101,6 +628,21 @@ class ConsolidatedPickingList(ReportMixin):
         """
         return (move.from_location, move.product)
 
+    @classmethod
+    def get_pick_rank(cls, moves):
+        """
+        Returns the rank on the pick path of a group of moves: the best rank
+        of the locations the moves are picked from.
+        """
+        Location = Pool().get('stock.location')
+
+        return min(
+            Location.get_pick_ranks(move.shipment.warehouse.id).get(
+                move.from_location.id
+            )
+            for move in moves
+        )
+
     @classmethod
     def get_moves(cls, shipment):
         return shipment.inventory_moves
@@ -120,15 +662,133 @@ class ConsolidatedPickingList(ReportMixin):
         return key[0].rec_name
 
     @classmethod
-    def get_context(cls, records, data):
+    def get_group_quantity(cls, moves, factors=None):
         """
-        The default implementation groups by product
-        and sorts by from_location.
+        Returns the total quantity of a group of moves in the default UOM
+        of the product.
+
+        The stored internal quantity of the moves is used when it is set,
+        otherwise the quantity is converted with a factor computed once per
+        (uom, default uom) pair and kept in factors.
         """
-        report_context = super(ConsolidatedPickingList, cls).get_context(
+        Uom = Pool().get('product.uom')
+
+        if factors is None:
+            factors = {}
+        total = 0.0
+        for move in moves:
+            if move.internal_quantity is not None:
+                total += move.internal_quantity
+                continue
+            default_uom = move.product.default_uom
+            key = (move.uom.id, default_uom.id)
+            if key not in factors:
+                factors[key] = Uom.compute_qty(
+                    move.uom, 1, default_uom, round=False
+                )
+            total += move.quantity * factors[key]
+        return moves[0].product.default_uom.round(total)
+
+    @classmethod
+    def can_stream(cls):
+        """
+        Returns True if the moves can be streamed, which groups them on
+        location and product in SQL: group_key and get_moves must not be
+        overridden by another module.
+        """
+        return all(
+            getattr(cls, name).__func__ is getattr(
+                ConsolidatedPickingList, name
+            ).__func__
+            for name in ('group_key', 'get_moves')
+        )
+
+    @classmethod
+    def is_streamed(cls, records, data):
+        stream = data.get('stream', len(records) >= cls.stream_threshold)
+        if stream and not cls.can_stream():
+            if data.get('stream'):
+                raise UserError(
+                    'The moves of %s can not be streamed as their grouping '
+                    'is customised' % cls.__name__
+                )
+            return False
+        return stream
+
+    @classmethod
+    def get_prefetch_fields(cls, records, data):
+        if cls.is_streamed(records, data):
+            # The moves are prefetched group by group
+            return []
+        return super(ConsolidatedPickingList, cls).get_prefetch_fields(
             records, data
         )
-        report_context['grouped_moves'] = []
+
+    @classmethod
+    def _ordered_move_rows(cls, records):
+        """
+        Yields (from_location, product, move) ids of the inventory moves of
+        the shipments ordered like the groups, following the pick path.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        ShipmentOut = pool.get('stock.shipment.out')
+        Location = pool.get('stock.location')
+        move = Move.__table__()
+        shipment = ShipmentOut.__table__()
+        warehouse = Location.__table__()
+        location = Location.__table__()
+        cursor = Transaction().connection.cursor()
+
+        cursor.execute(*move.join(shipment, condition=(
+            move.shipment == Concat(ShipmentOut.__name__ + ',', shipment.id)
+        )).join(warehouse, condition=(
+            warehouse.id == shipment.warehouse
+        )).join(location, condition=(
+            location.id == move.from_location
+        )).select(
+            move.from_location, move.product, move.id,
+            where=reduce_ids(shipment.id, [r.id for r in records])
+            & (move.to_location == warehouse.output_location),
+            order_by=[
+                Case((location.pick_sequence == Null, 1), else_=0),
+                location.pick_sequence, location.name, location.id,
+                move.product, move.id,
+            ],
+        ))
+        for row in cursor:
+            yield row
+
+    @classmethod
+    def stream_grouped_moves(cls, records):
+        """
+        Yields the grouped moves of the shipments one group at a time.
+
+        The moves are read from the database already ordered by location
+        and product, so only the moves of the current group are loaded.
+        This supports the default grouping on location and product only,
+        see :meth:`can_stream`.
+        """
+        Move = Pool().get('stock.move')
+
+        factors = {}
+        for _, rows in groupby(
+                cls._ordered_move_rows(records), key=lambda r: r[:2]):
+            moves = Move.browse([r[2] for r in rows])
+            cls.prefetch(moves, cls.move_prefetch_fields)
+            yield (
+                cls.group_key(moves[0]), moves,
+                cls.get_group_quantity(moves, factors)
+            )
+
+    @classmethod
+    def get_grouped_moves(cls, records):
+        """
+        Returns the moves of all the shipments grouped by group_key and
+        sorted on the pick path
+        """
+        grouped_moves = []
+        factors = {}
         for key, grouper in groupby(
                 # Sort all the moves from all shipments
                 # and then group it
@@ -138,11 +798,29 @@ class ConsolidatedPickingList(ReportMixin):
                     key=cls.group_key
                 )), cls.group_key):
             moves = list(grouper)
-            # TODO: Sum totals everything, the UOM to base UOM conversion
-            # is not done
-            report_context['grouped_moves'].append(
-                (key, moves, sum(map(lambda m: m.quantity, moves)))
+            grouped_moves.append(
+                (key, moves, cls.get_group_quantity(moves, factors))
             )
+        # Follow the pick path, keeping the order of the keys between
+        # groups of the same rank
+        grouped_moves.sort(key=lambda group: cls.get_pick_rank(group[1]))
+        return grouped_moves
+
+    @classmethod
+    def get_context(cls, records, data):
+        """
+        The default implementation groups by product
+        and sorts by from_location.
+        """
+        report_context = super(ConsolidatedPickingList, cls).get_context(
+            records, data
+        )
+        if cls.is_streamed(records, data):
+            report_context['grouped_moves'] = cls.stream_grouped_moves(
+                records
+            )
+        else:
+            report_context['grouped_moves'] = cls.get_grouped_moves(records)
 
         report_context['get_product_repr_from'] = cls.get_product_repr_from
         report_context['get_location_repr_from'] = cls.get_location_repr_from
@@ -153,6 +831,18 @@ class SupplierRestockingList(ReportMixin):
     'Supplier Restocking List'
     __name__ = 'report.supplier_restocking_list'
 
+    cache_fields = ['moves']
+    chunked = True
+
+    prefetch_fields = [
+        'supplier.rec_name',
+        'warehouse.rec_name',
+        'inventory_moves.product.code',
+        'inventory_moves.uom.symbol',
+        'inventory_moves.from_location.rec_name',
+        'inventory_moves.to_location.rec_name',
+    ]
+
     @classmethod
     def get_context(cls, records, data):
         report_context = super(SupplierRestockingList, cls).get_context(
@@ -168,6 +858,18 @@ class CustomerReturnRestockingList(ReportMixin):
     'Customer Return Restocking List'
     __name__ = 'report.customer_return_restocking_list'
 
+    cache_fields = ['moves']
+    chunked = True
+
+    prefetch_fields = [
+        'customer.rec_name',
+        'warehouse.rec_name',
+        'inventory_moves.product.code',
+        'inventory_moves.uom.symbol',
+        'inventory_moves.from_location.rec_name',
+        'inventory_moves.to_location.rec_name',
+    ]
+
     @classmethod
     def get_context(cls, records, data):
         report_context = super(CustomerReturnRestockingList, cls).get_context(
@@ -183,10 +885,33 @@ class DeliveryNote(ReportMixin):
     "Delivery Note"
     __name__ = 'report.delivery_note'
 
+    cache_fields = ['moves']
+    chunked = True
+
+    prefetch_fields = [
+        'customer.lang',
+        'delivery_address.full_address',
+        'weight_uom.symbol',
+        'outgoing_moves.product.code',
+        'outgoing_moves.uom.symbol',
+    ]
+
 
 class InternalShipmentReport(ReportMixin):
     __name__ = 'report.internal_shipment'
 
+    cache_fields = ['moves']
+    chunked = True
+
+    prefetch_fields = [
+        'from_location.rec_name',
+        'to_location.rec_name',
+        'moves.product.rec_name',
+        'moves.uom.symbol',
+        'moves.from_location.rec_name',
+        'moves.to_location.rec_name',
+    ]
+
 
 class ProductLedgerStartView(ModelView):
     'Product Ledger Start'
@@ -206,6 +931,32 @@ class ProductLedgerStartView(ModelView):
     )
     start_date = fields.Date('Start Date', required=True)
     end_date = fields.Date('End Date', required=True)
+    summary_only = fields.Boolean(
+        'Summary Only', help='Show the totals without the moves'
+    )
+
+    granularity = fields.Selection([
+        (None, 'Moves'),
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+        ('monthly', 'Monthly'),
+    ], 'Granularity', sort=False,
+        help='Show the moves summed per period and party')
+
+    export_format = fields.Selection([
+        ('csv', 'CSV'),
+        ('xlsx', 'Excel (XLSX)'),
+        ('jsonl', 'JSON Lines'),
+    ], 'Export Format', sort=False,
+        help='The format of the moves exported by the Export button')
+
+    @staticmethod
+    def default_summary_only():
+        return False
+
+    @staticmethod
+    def default_export_format():
+        return 'csv'
 
     @staticmethod
     def default_start_date():
@@ -222,65 +973,137 @@ class ProductLedgerReport(ReportMixin):
     'Product Ledger Report'
     __name__ = 'report.product_ledger'
 
+    #: The ledger buckets, each with the side of the move and the location
+    #: type a done move must match to be listed in it.
+    ledger_buckets = [
+        ('purchases', 'from_location', 'supplier'),
+        ('productions', 'from_location', 'production'),
+        ('customers', 'to_location', 'customer'),
+        ('lost_and_founds', 'from_location', 'lost_found'),
+        ('consumed', 'to_location', 'production'),
+    ]
+    #: The key of the total of each bucket in the summary
+    summary_keys = {
+        'purchases': 'purchased',
+        'productions': 'produced',
+        'customers': 'customer',
+        'lost_and_founds': 'lost',
+        'consumed': 'consumed',
+    }
+    #: The field of the order of the origins of the moves
+    origin_orders = {
+        'purchase.line': 'purchase',
+        'sale.line': 'sale',
+    }
+    #: The values of the moves shown in the detail tables, read when the
+    #: field of the move exists (production and operator are added by
+    #: optional modules)
+    detail_fields = {
+        'production_input': ['code', 'location.rec_name'],
+        'production_output': ['code', 'location.rec_name'],
+        'operator': ['rec_name'],
+    }
+    #: The shipment models whose code is shown in the detail tables
+    shipment_models = [
+        'stock.shipment.in',
+        'stock.shipment.in.return',
+        'stock.shipment.out',
+        'stock.shipment.out.return',
+        'stock.shipment.internal',
+    ]
+    #: The order of the ledger moves
+    ledger_order = [('effective_date', 'ASC'), ('id', 'ASC')]
+    #: The columns of the exported ledger rows
+    export_columns = [
+        'date', 'product_code', 'product', 'bucket', 'quantity', 'uom',
+        'shipment', 'origin',
+    ]
+    #: The length of the periods of each granularity
+    period_lengths = {
+        'daily': relativedelta(days=1),
+        'weekly': relativedelta(weeks=1),
+        'monthly': relativedelta(months=1),
+    }
+
     @classmethod
-    def get_purchases(cls, product_id, data):
-        Move = Pool().get('stock.move')
+    def _empty_buckets(cls, product_ids):
+        return dict(
+            (product_id, dict((b[0], []) for b in cls.ledger_buckets))
+            for product_id in product_ids
+        )
 
-        return Move.search([
+    @classmethod
+    def get_ledger_domain(cls, product_ids, data):
+        """
+        Returns the domain of the done moves of the products in the date
+        range which are in a bucket
+        """
+        buckets = ['OR']
+        for bucket, side, location_type in cls.ledger_buckets:
+            buckets.append(('%s.type' % side, '=', location_type))
+        return [
             ('effective_date', '>=', data['start_date']),
             ('effective_date', '<=', data['end_date']),
-            ('product', '=', product_id),
+            ('product', 'in', product_ids),
             ('state', '=', 'done'),
-            ('from_location.type', '=', 'supplier'),
-        ], order=[('effective_date', 'asc')])
+            buckets,
+        ]
 
     @classmethod
-    def get_productions(cls, product_id, data):
+    def get_ledger_moves(cls, product_ids, data):
+        """
+        Fetch the done moves of all the given products in the date range
+        with a single search and partition them by product and bucket.
+
+        Returns a dictionary of the form::
+
+            {product_id: {'purchases': [moves], 'customers': [moves], ...}}
+        """
         Move = Pool().get('stock.move')
 
-        return Move.search([
-            ('effective_date', '>=', data['start_date']),
-            ('effective_date', '<=', data['end_date']),
-            ('product', '=', product_id),
-            ('state', '=', 'done'),
-            ('from_location.type', '=', 'production'),
-        ], order=[('effective_date', 'asc')])
+        rv = cls._empty_buckets(product_ids)
+        for move in Move.search(
+                cls.get_ledger_domain(product_ids, data),
+                order=cls.ledger_order):
+            buckets = rv[move.product.id]
+            for bucket, side, location_type in cls.ledger_buckets:
+                if getattr(move, side).type == location_type:
+                    buckets[bucket].append(move)
+        return rv
 
     @classmethod
-    def get_customers(cls, product_id, data):
-        Move = Pool().get('stock.move')
+    def _get_bucket(cls, bucket, product_id, data, ledger_moves=None):
+        """
+        Returns the moves of the bucket from the partitioned ledger moves
+        of the product, fetching them if they were not given.
+        """
+        if ledger_moves is None:
+            ledger_moves = cls.get_ledger_moves([product_id], data)[
+                product_id
+            ]
+        return ledger_moves[bucket]
 
-        return Move.search([
-            ('effective_date', '>=', data['start_date']),
-            ('effective_date', '<=', data['end_date']),
-            ('product', '=', product_id),
-            ('state', '=', 'done'),
-            ('to_location.type', '=', 'customer'),
-        ], order=[('effective_date', 'asc')])
+    @classmethod
+    def get_purchases(cls, product_id, data, ledger_moves=None):
+        return cls._get_bucket('purchases', product_id, data, ledger_moves)
 
     @classmethod
-    def get_lost_and_founds(cls, product_id, data):
-        Move = Pool().get('stock.move')
+    def get_productions(cls, product_id, data, ledger_moves=None):
+        return cls._get_bucket('productions', product_id, data, ledger_moves)
 
-        return Move.search([
-            ('effective_date', '>=', data['start_date']),
-            ('effective_date', '<=', data['end_date']),
-            ('product', '=', product_id),
-            ('state', '=', 'done'),
-            ('from_location.type', '=', 'lost_found'),
-        ], order=[('effective_date', 'asc')])
+    @classmethod
+    def get_customers(cls, product_id, data, ledger_moves=None):
+        return cls._get_bucket('customers', product_id, data, ledger_moves)
 
     @classmethod
-    def get_consumed(cls, product_id, data):
-        Move = Pool().get('stock.move')
+    def get_lost_and_founds(cls, product_id, data, ledger_moves=None):
+        return cls._get_bucket(
+            'lost_and_founds', product_id, data, ledger_moves
+        )
 
-        return Move.search([
-            ('effective_date', '>=', data['start_date']),
-            ('effective_date', '<=', data['end_date']),
-            ('product', '=', product_id),
-            ('state', '=', 'done'),
-            ('to_location.type', '=', 'production'),
-        ], order=[('effective_date', 'asc')])
+    @classmethod
+    def get_consumed(cls, product_id, data, ledger_moves=None):
+        return cls._get_bucket('consumed', product_id, data, ledger_moves)
 
     @classmethod
     def _get_total_quantity(cls, moves):
@@ -293,31 +1116,553 @@ class ProductLedgerReport(ReportMixin):
         return sum
 
     @classmethod
-    def get_summary(cls, record, data):
-        Product = Pool().get('product.product')
+    def get_ledger_totals(cls, product_ids, data):
+        """
+        Returns the summary totals of the buckets of all the given products
+        in the date range. The totals of the closed months in the range are
+        taken from the product ledger months, only the moves of the other
+        days are summed.
+
+        Returns a dictionary of the form::
+
+            {product_id: {'purchased': 4.0, 'customer': 2.0, ...}}
+        """
+        LedgerMonth = Pool().get('product.ledger.month')
+
+        start_date, end_date = data['start_date'], data['end_date']
+        months = LedgerMonth.get_closed_months(start_date, end_date)
+        if not months:
+            return cls.sum_ledger_totals(product_ids, start_date, end_date)
+
+        ranges = [
+            (start_date, months[0] - relativedelta(days=1)),
+            (months[-1] + relativedelta(months=1), end_date),
+        ]
+        totals = [
+            cls.sum_ledger_totals(product_ids, start, end)
+            for start, end in ranges if start <= end
+        ]
+        totals.extend(LedgerMonth.get_totals(
+            product_ids, months, cls.sum_ledger_totals
+        ).itervalues())
+
+        rv = dict(
+            (product_id, dict.fromkeys(cls.summary_keys.values(), 0.0))
+            for product_id in product_ids
+        )
+        for product_totals in totals:
+            for product_id, values in product_totals.iteritems():
+                for key, total in values.iteritems():
+                    rv[product_id][key] += total
+        return rv
+
+    @classmethod
+    def sum_ledger_totals(cls, product_ids, start_date, end_date):
+        """
+        Returns the summary totals of the buckets of all the given products
+        between the dates, summed by the database with one query per slice
+        of products.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Location = pool.get('stock.location')
+        cursor = Transaction().connection.cursor()
+        move = Move.__table__()
+        locations = {
+            'from_location': Location.__table__(),
+            'to_location': Location.__table__(),
+        }
+
+        query = move
+        for side, location in locations.iteritems():
+            query = query.join(
+                location, condition=getattr(move, side) == location.id
+            )
+        # A move can be in more than one bucket, so each total is a sum
+        # of its own rather than a group
+        columns = [
+            Sum(Case(
+                (locations[side].type == location_type,
+                    move.internal_quantity),
+                else_=0.0))
+            for _, side, location_type in cls.ledger_buckets
+        ]
+        where = (
+            (move.state == 'done')
+            & (move.effective_date >= start_date)
+            & (move.effective_date <= end_date)
+        )
+
+        rv = dict(
+            (product_id, dict.fromkeys(cls.summary_keys.values(), 0.0))
+            for product_id in product_ids
+        )
+        for sub_ids in grouped_slice(product_ids):
+            cursor.execute(*query.select(
+                move.product, *columns,
+                where=where & reduce_ids(move.product, sub_ids),
+                group_by=[move.product]))
+            for row in cursor.fetchall():
+                rv[row[0]].update(
+                    (cls.summary_keys[b[0]], total or 0.0)
+                    for b, total in zip(cls.ledger_buckets, row[1:])
+                )
+        return rv
+
+    @staticmethod
+    def get_period(date, granularity):
+        """
+        Returns the first day of the period of the date
+        """
+        if granularity == 'weekly':
+            return date - relativedelta(days=date.weekday())
+        elif granularity == 'monthly':
+            return date.replace(day=1)
+        return date
+
+    @classmethod
+    def _counterparty_query(cls):
+        """
+        Returns the moves joined to the orders of their origin and the
+        party of the order. Purchases are only joined when the purchase
+        module is installed.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        move = Move.__table__()
+
+        # The id of the origin is cast to join on the primary key of the
+        # lines whatever the spacing of the reference
+        origin_id = Cast(
+            Substring(move.origin, Position(',', move.origin) + 1),
+            Move.id.sql_type().base
+        )
+        query, party = move, Null
+        for line_model, order_model, field in [
+                ('sale.line', 'sale.sale', 'sale'),
+                ('purchase.line', 'purchase.purchase', 'purchase')]:
+            try:
+                line = pool.get(line_model).__table__()
+                order = pool.get(order_model).__table__()
+            except KeyError:
+                continue
+            query = query.join(
+                line, 'LEFT',
+                condition=move.origin.like(line_model + ',%')
+                & (line.id == origin_id)
+            ).join(
+                order, 'LEFT', condition=getattr(line, field) == order.id
+            )
+            party = order.party if party is Null else Coalesce(
+                party, order.party
+            )
+        return query, move, party
+
+    @classmethod
+    def get_period_totals(cls, product_ids, data):
+        """
+        Returns the quantities of the buckets of the products summed per
+        period and party by the database, with one query per bucket and
+        slice of products. The moves are summed per day and the days in
+        their period, as truncating dates is not portable.
+
+        Returns a dictionary of the form::
+
+            {product_id: {(period, bucket, party_id): quantity}}
+        """
+        pool = Pool()
+        Location = pool.get('stock.location')
+        cursor = Transaction().connection.cursor()
+
+        rv = dict((p, defaultdict(float)) for p in product_ids)
+        for bucket, side, location_type in cls.ledger_buckets:
+            query, move, party = cls._counterparty_query()
+            location = Location.__table__()
+            query = query.join(
+                location, condition=getattr(move, side) == location.id
+            )
+            where = (
+                (move.state == 'done')
+                & (location.type == location_type)
+                & (move.effective_date >= data['start_date'])
+                & (move.effective_date <= data['end_date'])
+            )
+            for sub_ids in grouped_slice(product_ids):
+                cursor.execute(*query.select(
+                    move.product, move.effective_date, party,
+                    Sum(move.internal_quantity),
+                    where=where & reduce_ids(move.product, sub_ids),
+                    group_by=[move.product, move.effective_date, party]))
+                for product_id, date, party_id, quantity in cursor.fetchall():
+                    period = cls.get_period(date, data['granularity'])
+                    rv[product_id][(period, bucket, party_id)] += quantity
+        return rv
+
+    @classmethod
+    def get_period_deltas(cls, product_ids, data):
+        """
+        Returns the change of the stock of the products in the warehouses
+        per period::
 
-        rv = {}
+            {product_id: {period: quantity}}
+        """
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Snapshot = pool.get('stock.balance.snapshot')
+
+        rv = dict((p, defaultdict(float)) for p in product_ids)
+        for warehouse in Location.browse(data['warehouses']):
+            moves = Snapshot.get_daily_moves(
+                warehouse, product_ids,
+                data['start_date'] - relativedelta(days=1), data['end_date']
+            )
+            for (product_id, date), quantity in moves.iteritems():
+                period = cls.get_period(date, data['granularity'])
+                rv[product_id][period] += quantity
+        return rv
+
+    @classmethod
+    def get_periods(cls, product_ids, data, balances):
+        """
+        Returns the periods of the products with the quantities of the
+        buckets per party and the stock balance at the end of the period.
+
+        Returns a dictionary of the form::
+
+            {product_id: [{
+                'start': date, 'end': date, 'balance': 5.0,
+                'lines': [{'bucket': 'purchases', 'party': 'Supplier',
+                    'quantity': 4.0}, ...],
+            }, ...]}
+        """
+        Party = Pool().get('party.party')
+
+        totals = cls.get_period_totals(product_ids, data)
+        deltas = cls.get_period_deltas(product_ids, data)
+        party_ids = set(
+            key[2] for product_totals in totals.itervalues()
+            for key in product_totals if key[2] is not None
+        )
+        names = dict(
+            (p.id, p.rec_name) for p in Party.browse(list(party_ids))
+        )
+        return dict((product_id, cls._build_periods(
+            totals[product_id], deltas[product_id],
+            balances[product_id]['opening_stock'], names, data
+        )) for product_id in product_ids)
+
+    @classmethod
+    def _build_periods(cls, totals, deltas, balance, names, data):
+        order = dict((b[0], i) for i, b in enumerate(cls.ledger_buckets))
+        lines = defaultdict(list)
+        for (period, bucket, party_id), quantity in sorted(
+                totals.iteritems(), key=lambda i: (
+                    i[0][0], order[i[0][1]], names.get(i[0][2]))):
+            lines[period].append({
+                'bucket': bucket,
+                'party': names.get(party_id),
+                'quantity': quantity,
+            })
+
+        length = cls.period_lengths[data['granularity']]
+        periods = []
+        for period in sorted(set(lines) | set(deltas)):
+            balance += deltas.get(period, 0.0)
+            periods.append({
+                'start': max(period, data['start_date']),
+                'end': min(
+                    period + length - relativedelta(days=1),
+                    data['end_date']
+                ),
+                'lines': lines[period],
+                'balance': balance,
+            })
+        return periods
+
+    @classmethod
+    def iter_ledger_rows(cls, data, batch_size=1000):
+        """
+        Yields the rows of the ledger moves of the products, as tuples of
+        the export_columns, in the order of the moves. A move in two
+        buckets gives two rows.
+
+        Only the ids of the moves are selected at once, the moves are read
+        by batches so that the memory used does not depend on the number
+        of moves.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Product = pool.get('product.product')
+        cursor = Transaction().connection.cursor()
+
+        products = dict(
+            (p.id, (p.code, p.rec_name))
+            for p in Product.browse(data['products'])
+        )
+        cursor.execute(*Move.search(
+            cls.get_ledger_domain(data['products'], data),
+            order=cls.ledger_order, query=True))
+        while True:
+            move_ids = [row[0] for row in cursor.fetchmany(batch_size)]
+            if not move_ids:
+                break
+            for row in cls._get_ledger_rows(move_ids, products):
+                yield row
+
+    @classmethod
+    def _get_ledger_rows(cls, move_ids, products):
+        Move = Pool().get('stock.move')
+
+        index = dict((move_id, i) for i, move_id in enumerate(move_ids))
+        moves = sorted(Move.read(move_ids, [
+            'product', 'effective_date', 'quantity', 'uom.symbol',
+            'from_location.type', 'to_location.type', 'shipment', 'origin',
+        ]), key=lambda m: index[m['id']])
+        names = cls.get_reference_names(
+            [m['shipment'] for m in moves] + [m['origin'] for m in moves]
+        )
+        for move in moves:
+            code, name = products[move['product']]
+            for bucket, side, location_type in cls.ledger_buckets:
+                if move['%s.type' % side] != location_type:
+                    continue
+                yield (
+                    move['effective_date'], code, name, bucket,
+                    move['quantity'], move['uom.symbol'],
+                    names.get(move['shipment']), names.get(move['origin']),
+                )
+
+    @staticmethod
+    def _get_rec_names(model, record_ids):
+        try:
+            Model = Pool().get(model)
+        except KeyError:
+            # The model of the reference is not installed
+            return {}
+        return dict(
+            ((model, r.id), r.rec_name) for r in Model.browse(list(record_ids))
+        )
+
+    @staticmethod
+    def _parse_reference(reference):
+        model, record_id = reference.split(',', 1)
+        return model, int(record_id)
+
+    @classmethod
+    def get_reference_names(cls, references):
+        """
+        Returns the record name of the references, read with one browse
+        per model::
+
+            {'sale.line,1': u'Product - 1 u', ...}
+        """
+        references = set(filter(None, references))
+        keys = dict(zip(references, map(cls._parse_reference, references)))
+        ids = defaultdict(set)
+        for model, record_id in keys.itervalues():
+            ids[model].add(record_id)
+        rec_names = {}
+        for model, record_ids in ids.iteritems():
+            rec_names.update(cls._get_rec_names(model, record_ids))
+        return dict(zip(keys.keys(), map(rec_names.get, keys.values())))
+
+    @staticmethod
+    def _read_model(model, ids, fields_names):
+        try:
+            Model = Pool().get(model)
+        except KeyError:
+            # The model of the reference is not installed
+            return []
+        return Model.read(list(ids), fields_names)
+
+    @classmethod
+    def read_references(cls, references, model_fields):
+        """
+        Returns the values of the records of the references, read with one
+        read per model. The references to a model missing from
+        model_fields are ignored::
+
+            {'sale.line,1': {'id': 1, 'sale.reference': u'SO1', ...}}
+        """
+        references = set(filter(None, references))
+        keys = dict(zip(references, map(cls._parse_reference, references)))
+        ids = defaultdict(set)
+        for model, record_id in keys.itervalues():
+            if model in model_fields and record_id >= 0:
+                ids[model].add(record_id)
+        values = {}
+        for model, record_ids in ids.iteritems():
+            for row in cls._read_model(
+                    model, record_ids, model_fields[model]):
+                values[(model, row['id'])] = row
+        return dict(zip(keys.keys(), map(values.get, keys.values())))
+
+    @classmethod
+    def get_move_details(cls, moves):
+        """
+        Returns the values of the detail tables of the moves, so that the
+        template does not resolve the origin, shipment, production and
+        operator of each move one by one. The moves are read once, and the
+        records they refer to with one read per model.
+
+        Returns a dictionary of the form::
+
+            {move_id: {
+                'party': u'Supplier', 'reference': u'PO1',
+                'shipment': u'IN1', 'production': u'MO1',
+                'production_location': u'Production', 'consumed': False,
+                'operator': u'Operator',
+            }}
+        """
+        Move = Pool().get('stock.move')
+
+        fields_names = ['shipment', 'origin']
+        for field, targets in cls.detail_fields.iteritems():
+            if field in Move._fields:
+                fields_names.extend('%s.%s' % (field, t) for t in targets)
+        # A move in two buckets is only read once
+        values = Move.read(list(set(m.id for m in moves)), fields_names)
+
+        origins = cls.read_references(
+            [v['origin'] for v in values], dict(
+                (model, ['%s.reference' % order, '%s.party.rec_name' % order])
+                for model, order in cls.origin_orders.iteritems()
+            )
+        )
+        shipments = cls.read_references(
+            [v['shipment'] for v in values],
+            dict((model, ['code']) for model in cls.shipment_models)
+        )
+        return dict(
+            (v['id'], cls._get_move_detail(
+                v, origins.get(v['origin']), shipments.get(v['shipment'])
+            )) for v in values
+        )
+
+    @classmethod
+    def _get_move_detail(cls, values, origin, shipment):
+        detail = {
+            'party': None,
+            'reference': None,
+            'shipment': shipment and shipment['code'],
+        }
+        if origin:
+            order = cls.origin_orders[values['origin'].split(',', 1)[0]]
+            detail['party'] = origin['%s.party.rec_name' % order]
+            detail['reference'] = origin['%s.reference' % order]
+        consumed = bool(values.get('production_input.code'))
+        production = 'production_input' if consumed else 'production_output'
+        detail.update({
+            'production': values.get('%s.code' % production),
+            'production_location': values.get(
+                '%s.location.rec_name' % production
+            ),
+            'consumed': consumed,
+            'operator': values.get('operator.rec_name'),
+        })
+        return detail
+
+    @classmethod
+    def get_stock_balances(cls, products, data):
+        """
+        Returns the opening and closing stock of all the given products in
+        the warehouses. The balances at the end of the days before today are
+        computed from the stock balance snapshots, the others with one stock
+        quantity computation per date.
+
+        Returns a dictionary of the form::
+
+            {product_id: {'opening_stock': 1.0, 'closing_stock': 5.0}}
+        """
+        pool = Pool()
+        Product = pool.get('product.product')
+        Snapshot = pool.get('stock.balance.snapshot')
+        Date = pool.get('ir.date')
+
+        rv = dict((p.id, {}) for p in products)
+        today = Date.today()
+        for key, date in [
+                ('opening_stock', data['start_date'] - relativedelta(days=1)),
+                ('closing_stock', data['end_date'])]:
+            if date < today and data['warehouses']:
+                quantities = Snapshot.get_balances(
+                    rv.keys(), data['warehouses'], date
+                )
+            else:
+                with Transaction().set_context(
+                    locations=data['warehouses'], stock_date_end=date
+                ):
+                    quantities = Product.get_quantity(products, 'quantity')
+            for product_id, quantity in quantities.iteritems():
+                rv[product_id][key] = quantity
+        return rv
+
+    @classmethod
+    def get_summary(cls, record, data, balances=None, totals=None):
+        """
+        Returns the summary of the ledger record.
+
+        :param balances: The opening and closing stock of the product as
+                         returned by :meth:`get_stock_balances`. Computed if
+                         not given.
+        :param totals: The totals of the buckets of the product as returned
+                       by :meth:`get_ledger_totals`. Summed from the moves
+                       of the record if not given.
+        """
         product = record['product']
-        with Transaction().set_context(
-            locations=data['warehouses'],
-            stock_date_end=data['start_date'] - relativedelta(days=1)
-        ):
-            rv['opening_stock'] = Product(product.id).quantity
-
-        with Transaction().set_context(
-            locations=data['warehouses'], stock_date_end=data['end_date']
-        ):
-            rv['closing_stock'] = Product(product.id).quantity
-
-        rv['purchased'] = cls._get_total_quantity(record['purchases'])
-        rv['produced'] = cls._get_total_quantity(record['productions'])
-        rv['customer'] = cls._get_total_quantity(record['customers'])
-        rv['lost'] = cls._get_total_quantity(record['lost_and_founds'])
-        rv['consumed'] = cls._get_total_quantity(record['consumed'])
+        if balances is None:
+            balances = cls.get_stock_balances([product], data)[product.id]
+
+        rv = dict(balances)
+        if totals is None:
+            totals = dict(
+                (key, cls._get_total_quantity(record[bucket]))
+                for bucket, key in cls.summary_keys.iteritems()
+            )
+        rv.update(totals)
         return rv
 
+    @classmethod
+    def get_record(cls, product, data, ledger_moves):
+        """
+        Returns the ledger record of the product with the moves of each
+        bucket
+        """
+        record = {
+            'product': product,
+        }
+        for bucket, getter in [
+                ('purchases', cls.get_purchases),
+                ('productions', cls.get_productions),
+                ('customers', cls.get_customers),
+                ('lost_and_founds', cls.get_lost_and_founds),
+                ('consumed', cls.get_consumed),
+                ]:
+            record[bucket] = cls._call_bucket_getter(
+                getter, product.id, data, ledger_moves
+            )
+        return record
+
+    @staticmethod
+    def _call_bucket_getter(getter, product_id, data, ledger_moves):
+        """
+        Returns the moves of the getter of a bucket, given the partitioned
+        moves of the product unless it is an override with the former
+        (product_id, data) signature, which fetches them itself.
+        """
+        spec = inspect.getargspec(getter)
+        if 'ledger_moves' in spec.args or spec.keywords:
+            return getter(product_id, data, ledger_moves=ledger_moves)
+        return getter(product_id, data)
+
     @classmethod
     def get_context(cls, objects, data):
+        """
+        The summary is computed without reading the moves, which are only
+        fetched for the detail tables unless summary_only is set in data.
+        With a granularity in data, the detail tables are replaced by the
+        quantities summed per period and party.
+        """
         Product = Pool().get('product.product')
         Locations = Pool().get('stock.location')
 
@@ -326,24 +1671,56 @@ class ProductLedgerReport(ReportMixin):
         )
         records = []
         summary = {}
-        for product_id in data['products']:
-            product = Product(product_id)
-            record = {
-                'product': product,
-                'purchases': cls.get_purchases(product.id, data),
-                'productions': cls.get_productions(product.id, data),
-                'customers': cls.get_customers(product.id, data),
-                'lost_and_founds': cls.get_lost_and_founds(product.id, data),
-                'consumed': cls.get_consumed(product.id, data)
-            }
+        products = Product.browse(data['products'])
+        if data.get('summary_only') or data.get('granularity'):
+            ledger_moves = cls._empty_buckets(data['products'])
+        else:
+            ledger_moves = cls.get_ledger_moves(data['products'], data)
+        balances = cls.get_stock_balances(products, data)
+        totals = cls.get_ledger_totals(data['products'], data)
+        periods = {}
+        if data.get('granularity') and not data.get('summary_only'):
+            periods = cls.get_periods(data['products'], data, balances)
+        details = cls.get_move_details([
+            move for buckets in ledger_moves.itervalues()
+            for moves in buckets.itervalues() for move in moves
+        ])
+        for product in products:
+            record = cls.get_record(product, data, ledger_moves[product.id])
+            record['periods'] = periods.get(product.id)
             records.append(record)
-            summary[product] = cls.get_summary(record, data)
+            summary[product] = cls.get_summary(
+                record, data, balances[product.id], totals[product.id]
+            )
 
+        report_context['records'] = records
+        report_context['details'] = details
         report_context['summary'] = summary
         report_context['warehouses'] = Locations.browse(data['warehouses'])
         return report_context
 
 
+class ProductLedgerExport(Report):
+    'Product Ledger Export'
+    __name__ = 'report.product_ledger_export'
+
+    @classmethod
+    def execute(cls, ids, data):
+        """
+        Returns the rows of the ledger moves written in the format of the
+        data, without rendering any template
+        """
+        LedgerReport = Pool().get('report.product_ledger', type='report')
+        cls.check_access()
+
+        format_ = data.get('format') or 'csv'
+        content = export(
+            LedgerReport.iter_ledger_rows(data),
+            LedgerReport.export_columns, format_
+        )
+        return format_, bytearray(content), False, 'Product Ledger'
+
+
 class ProductLedger(Wizard):
     'Wizard for generating product ledger'
     __name__ = 'product.product.ledger.wizard'
@@ -353,21 +1730,33 @@ class ProductLedger(Wizard):
         'report_html_stock.wizard_product_ledger_start_form',
         [
             Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Export', 'export', 'tryton-save'),
             Button('View', 'view', 'tryton-go-next', default=True),
         ]
     )
     view = StateAction('report_html_stock.report_product_ledger')
+    export = StateAction('report_html_stock.report_product_ledger_export')
 
     def default_start(self, fields):
         return {
             'products': Transaction().context.get('active_ids'),
         }
 
-    def do_view(self, action):
-        data = {
+    def get_data(self):
+        return {
             'products': map(int, self.start.products),
             'warehouses': map(int, self.start.warehouses),
             'start_date': self.start.start_date,
             'end_date': self.start.end_date,
+            # Not sent by the clients which do not know the field
+            'summary_only': getattr(self.start, 'summary_only', False),
+            'granularity': getattr(self.start, 'granularity', None),
         }
+
+    def do_view(self, action):
+        return action, self.get_data()
+
+    def do_export(self, action):
+        data = self.get_data()
+        data['format'] = getattr(self.start, 'export_format', None) or 'csv'
         return action, data
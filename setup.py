@@ -127,7 +127,8 @@ setup(
         ['view/*.xml', 'reports/*.html'] +
         ['web/static/images/passbook/*.png', 'reports/css/bootstrap/css/*'] +
         ['reports/css/bootstrap/fonts/*', 'reports/css/font-awesome/css/*'] +
-        ['reports/js/*.js', 'reports/css/font-awesome/fonts/*']
+        ['reports/js/*.js', 'reports/css/font-awesome/fonts/*'] +
+        ['reports/css/*.css']
     },
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+    Daily snapshots of the stock balance of the products in the warehouses,
+    so that the balance at a date is the nearest snapshot plus the few
+    moves done since, instead of the moves of the whole history.
+"""
+from itertools import chain
+from collections import defaultdict
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+from sql.aggregate import Max, Sum
+from sql.conditionals import Case, Coalesce
+
+from trytond import backend
+from trytond.config import config
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.tools import reduce_ids, grouped_slice
+from trytond.transaction import Transaction
+
+__all__ = ['StockBalanceSnapshot']
+
+
+class StockBalanceSnapshot(ModelSQL, ModelView):
+    """
+    Stock Balance Snapshot
+
+    The quantity, in the default unit of the product, in the warehouse at
+    the end of the date. A snapshot is only stored for the dates the
+    balance of the product changed, so the balance at a date is the one of
+    the latest snapshot before it plus the moves done after the snapshot.
+    Moves until is the time until which the moves were read when the
+    snapshot was stored, the moves changed after it are checked at the
+    next run.
+    """
+    __name__ = 'stock.balance.snapshot'
+
+    product = fields.Many2One(
+        'product.product', 'Product', required=True, readonly=True,
+        select=True, ondelete='CASCADE'
+    )
+    location = fields.Many2One(
+        'stock.location', 'Warehouse', required=True, readonly=True,
+        select=True, ondelete='CASCADE', domain=[('type', '=', 'warehouse')]
+    )
+    date = fields.Date('Date', required=True, readonly=True, select=True)
+    quantity = fields.Float('Quantity', required=True, readonly=True)
+    moves_until = fields.DateTime('Moves Until', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(StockBalanceSnapshot, cls).__setup__()
+        cls._order = [
+            ('date', 'DESC'),
+            ('id', 'DESC'),
+        ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+
+        super(StockBalanceSnapshot, cls).__register__(module_name)
+        table = TableHandler(cls, module_name)
+        table.index_action(['product', 'location', 'date'], 'add')
+
+    @staticmethod
+    def _warehouse_moves(warehouse):
+        """
+        Returns the tables of the moves joined to their locations, the
+        conditions of the moves entering or leaving the warehouse and the
+        quantity they add to its balance.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Location = pool.get('stock.location')
+        move = Move.__table__()
+        from_location = Location.__table__()
+        to_location = Location.__table__()
+
+        inside_from = (
+            (from_location.left >= warehouse.left)
+            & (from_location.right <= warehouse.right)
+        )
+        inside_to = (
+            (to_location.left >= warehouse.left)
+            & (to_location.right <= warehouse.right)
+        )
+        query = move.join(
+            from_location, condition=move.from_location == from_location.id
+        ).join(
+            to_location, condition=move.to_location == to_location.id
+        )
+        where = (
+            (move.state == 'done')
+            & ((inside_to & ~inside_from) | (inside_from & ~inside_to))
+        )
+        quantity = Case(
+            (inside_to, move.internal_quantity),
+            else_=-move.internal_quantity)
+        return query, move, where, quantity
+
+    @classmethod
+    def get_daily_moves(cls, warehouse, product_ids, start, end):
+        """
+        Returns the quantity of the done moves entering or leaving the
+        warehouse after start and until end, per product and date::
+
+            {(product_id, date): quantity}
+
+        Every product is returned if product_ids is None and the whole
+        history if start is None.
+        """
+        cursor = Transaction().connection.cursor()
+        query, move, where, quantity = cls._warehouse_moves(warehouse)
+
+        where &= move.effective_date <= end
+        if start is not None:
+            where &= move.effective_date > start
+        result = {}
+        for sub_where in cls._product_wheres(move, product_ids):
+            cursor.execute(*query.select(
+                move.product, move.effective_date, Sum(quantity),
+                where=where & sub_where,
+                group_by=[move.product, move.effective_date]))
+            for product_id, date, total in cursor.fetchall():
+                result[(product_id, date)] = total or 0.0
+        return result
+
+    @staticmethod
+    def _product_wheres(table, product_ids):
+        """
+        Yields the conditions on the product column of the table for the
+        slices of product_ids, or no condition if it is None.
+        """
+        if product_ids is None:
+            yield table.product != None  # noqa
+            return
+        for sub_ids in grouped_slice(product_ids):
+            yield reduce_ids(table.product, sub_ids)
+
+    @classmethod
+    def _get_latest(cls, warehouse_id, product_ids, date):
+        """
+        Returns the date and quantity of the latest snapshot of the products
+        in the warehouse at or before the date::
+
+            {product_id: (date, quantity)}
+        """
+        cursor = Transaction().connection.cursor()
+        snapshot = cls.__table__()
+        latest = cls.__table__()
+
+        latest_date = latest.select(
+            Max(latest.date),
+            where=(latest.product == snapshot.product)
+            & (latest.location == snapshot.location)
+            & (latest.date <= date))
+
+        result = {}
+        for sub_where in cls._product_wheres(snapshot, product_ids):
+            cursor.execute(*snapshot.select(
+                snapshot.product, snapshot.date, snapshot.quantity,
+                where=sub_where
+                & (snapshot.location == warehouse_id)
+                & (snapshot.date == latest_date)))
+            for product_id, snapshot_date, quantity in cursor.fetchall():
+                result[product_id] = (snapshot_date, quantity)
+        return result
+
+    @classmethod
+    def get_balances(cls, product_ids, warehouse_ids, date):
+        """
+        Returns the quantity of the products in the warehouses at the end of
+        the date, from the done moves only, as the latest snapshot of each
+        product plus the moves done after it::
+
+            {product_id: quantity}
+        """
+        Location = Pool().get('stock.location')
+
+        balances = dict.fromkeys(product_ids, 0.0)
+        for warehouse in Location.browse(warehouse_ids):
+            for product_id, quantity in cls._get_warehouse_balances(
+                    warehouse, product_ids, date).iteritems():
+                balances[product_id] += quantity
+        return balances
+
+    @classmethod
+    def _get_warehouse_balances(cls, warehouse, product_ids, date):
+        latest = cls._get_latest(warehouse.id, product_ids, date)
+        balances = dict((p, q) for p, (_, q) in latest.iteritems())
+
+        # The products without snapshot need the moves of the whole history,
+        # the others only the moves after their snapshot
+        without = [p for p in product_ids if p not in latest]
+        moves = cls.get_daily_moves(warehouse, without, None, date) \
+            if without else {}
+        if latest:
+            start = min(d for d, _ in latest.itervalues())
+            moves.update(
+                (k, q) for k, q in cls.get_daily_moves(
+                    warehouse, latest.keys(), start, date).iteritems()
+                if k[1] > latest[k[0]][0]
+            )
+        for (product_id, _), quantity in moves.iteritems():
+            balances[product_id] = balances.get(product_id, 0.0) + quantity
+        return balances
+
+    @classmethod
+    def update_snapshots(cls, date=None):
+        """
+        Store the snapshots of the products whose balance changed in each
+        warehouse since the last snapshots, until the date or yesterday.
+        It is called by the cron.
+        """
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Location = pool.get('stock.location')
+
+        if date is None:
+            date = Date.today() - relativedelta(days=1)
+        for warehouse in Location.search([('type', '=', 'warehouse')]):
+            cls._update_warehouse(warehouse, date)
+
+    @staticmethod
+    def get_margin():
+        """
+        Returns the time substracted from the last change of the moves read
+        by a run, so that the next run checks again the moves of the
+        transactions which started before it but were committed after it::
+
+            [report_html_stock]
+            # In seconds
+            snapshot_margin = 3600
+        """
+        return timedelta(seconds=config.getint(
+            'report_html_stock', 'snapshot_margin', default=3600
+        ))
+
+    @classmethod
+    def _get_last_snapshot(cls, warehouse):
+        """
+        Returns the latest date of the snapshots of the warehouse and the
+        time until which the moves were read by the last run
+        """
+        domain = [('location', '=', warehouse.id)]
+        latest = cls.search(domain, order=[('date', 'DESC')], limit=1)
+        if not latest:
+            return None, None
+        last = cls.search(domain + [
+            ('moves_until', '!=', None),
+        ], order=[('moves_until', 'DESC')], limit=1)
+        if not last:
+            # The snapshots stored before the moves were tracked are checked
+            # against every move
+            return latest[0].date, datetime.min
+        return latest[0].date, last[0].moves_until
+
+    @classmethod
+    def _get_moves_until(cls, warehouse):
+        """
+        Returns the last change of the done moves of the warehouse, minus
+        the margin, or None without moves
+        """
+        cursor = Transaction().connection.cursor()
+        query, move, where, _ = cls._warehouse_moves(warehouse)
+
+        # The columns are selected rather than their maximum as the
+        # aggregates are not converted to datetimes by every backend
+        cursor.execute(*query.select(
+            move.write_date, move.create_date, where=where,
+            order_by=[Coalesce(move.write_date, move.create_date).desc],
+            limit=1))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return (row[0] or row[1]) - cls.get_margin()
+
+    @classmethod
+    def _update_warehouse(cls, warehouse, date):
+        last_date, last_until = cls._get_last_snapshot(warehouse)
+        moves_until = cls._get_moves_until(warehouse)
+        product_ids, dates = cls._invalidate(warehouse, last_date, last_until)
+        if last_date is None or last_date < date:
+            moves = cls.get_daily_moves(warehouse, None, last_date, date)
+            product_ids.update(p for p, _ in moves)
+        if product_ids:
+            dates[date] = product_ids
+        for snapshot_date, product_ids in sorted(dates.iteritems()):
+            cls._store(
+                warehouse, snapshot_date, sorted(product_ids), moves_until
+            )
+
+    @classmethod
+    def _store(cls, warehouse, date, product_ids, moves_until):
+        """
+        Store the snapshots of the products in the warehouse at the date
+        """
+        cls.delete(cls.search([
+            ('location', '=', warehouse.id),
+            ('product', 'in', product_ids),
+            ('date', '=', date),
+        ]))
+        balances = cls.get_balances(product_ids, [warehouse.id], date)
+        cls.create([{
+            'product': product_id,
+            'location': warehouse.id,
+            'date': date,
+            'quantity': balances[product_id],
+            'moves_until': moves_until,
+        } for product_id in product_ids])
+
+    @classmethod
+    def invalidate(cls, moves):
+        """
+        Delete the snapshots of the products of the done moves from their
+        effective date, so that the balances include them before the next
+        run stores the snapshots again
+        """
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        products = cls._by_first_date(
+            (m.product.id, m.effective_date) for m in moves
+            if m.state == 'done' and m.effective_date
+        )
+        for first_date, product_ids in products.iteritems():
+            for sub_ids in grouped_slice(product_ids):
+                cursor.execute(*table.delete(
+                    where=(table.date >= first_date)
+                    & reduce_ids(table.product, sub_ids)))
+
+    @classmethod
+    def _invalidate(cls, warehouse, last_date, last_until):
+        """
+        Delete the snapshots made wrong by the moves changed since the last
+        run with an effective date before the last snapshot. Returns the set
+        of their products and the products of the deleted snapshots per
+        date, to store them again::
+
+            (product_ids, {date: product_ids})
+        """
+        if last_until is None:
+            return set(), {}
+        products = cls._by_first_date(
+            cls._get_changed_dates(warehouse, last_date, last_until)
+        )
+
+        deleted = defaultdict(set)
+        for first_date, product_ids in products.iteritems():
+            snapshots = cls.search([
+                ('location', '=', warehouse.id),
+                ('product', 'in', product_ids),
+                ('date', '>=', first_date),
+            ])
+            for snapshot in snapshots:
+                deleted[snapshot.date].add(snapshot.product.id)
+            cls.delete(snapshots)
+        return set(chain.from_iterable(products.itervalues())), deleted
+
+    @classmethod
+    def _get_changed_dates(cls, warehouse, last_date, last_until):
+        """
+        Returns the products and effective dates of the moves changed since
+        last_until and effective until last_date
+        """
+        cursor = Transaction().connection.cursor()
+        query, move, where, _ = cls._warehouse_moves(warehouse)
+
+        # The dates are grouped rather than aggregated as the aggregates are
+        # not converted to dates by every backend
+        cursor.execute(*query.select(
+            move.product, move.effective_date,
+            where=where
+            & (Coalesce(move.write_date, move.create_date) >= last_until)
+            & (move.effective_date <= last_date),
+            group_by=[move.product, move.effective_date]))
+        return cursor.fetchall()
+
+    @staticmethod
+    def _by_first_date(dates):
+        """
+        Returns the products of the (product_id, date) pairs grouped by
+        their first date::
+
+            {date: [product_id]}
+        """
+        first_dates = {}
+        for product_id, date in dates:
+            first_dates[product_id] = min(
+                date, first_dates.get(product_id, date)
+            )
+        products = defaultdict(list)
+        for product_id, first_date in first_dates.iteritems():
+            products[first_date].append(product_id)
+        return products
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+    Statistics of the report executions, stored when enabled in the
+    configuration.
+"""
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.transaction import Transaction
+
+__all__ = ['ReportStatistic']
+
+#: Phases of the executions stored with their own duration and queries
+PHASES = ['context', 'render', 'convert', 'cache']
+
+
+class ReportStatistic(ModelSQL, ModelView):
+    "Report Statistic"
+    __name__ = 'report.statistic'
+
+    report = fields.Char('Report', required=True, readonly=True, select=True)
+    user = fields.Many2One('res.user', 'User', readonly=True)
+    records = fields.Integer('Records', readonly=True)
+    duration = fields.Float('Duration', readonly=True)
+    queries = fields.Integer('Queries', readonly=True)
+    context_duration = fields.Float('Context Duration', readonly=True)
+    context_queries = fields.Integer('Context Queries', readonly=True)
+    render_duration = fields.Float('Render Duration', readonly=True)
+    render_queries = fields.Integer('Render Queries', readonly=True)
+    convert_duration = fields.Float('Convert Duration', readonly=True)
+    convert_queries = fields.Integer('Convert Queries', readonly=True)
+    cache_duration = fields.Float('Cache Duration', readonly=True)
+    cache_queries = fields.Integer('Cache Queries', readonly=True)
+    cache_hit = fields.Boolean('Cache Hit', readonly=True)
+    html_size = fields.Integer('HTML Size', readonly=True)
+    pdf_size = fields.Integer('PDF Size', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(ReportStatistic, cls).__setup__()
+        cls._order = [
+            ('create_date', 'DESC'),
+            ('id', 'DESC'),
+        ]
+
+    @classmethod
+    def create_from_stats(cls, stats_list):
+        """
+        Create the statistics of the ReportStats
+        """
+        vlist = []
+        for stats in stats_list:
+            values = {
+                'report': stats.report,
+                'user': Transaction().user,
+                'records': stats.records,
+                'duration': stats.duration,
+                'queries': stats.total_queries,
+                'cache_hit': stats.cache_hit,
+                'html_size': stats.html_size,
+                'pdf_size': stats.pdf_size,
+            }
+            for phase in PHASES:
+                values['%s_duration' % phase] = stats.durations.get(phase)
+                values['%s_queries' % phase] = stats.queries.get(phase)
+            vlist.append(values)
+        return cls.create(vlist)
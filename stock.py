@@ -3,11 +3,20 @@
     :copyright: (c) 2015 by Fulfil.IO Inc.
     :license: BSD, see LICENSE for more details.
 """
+from itertools import chain
+
+from sql.operators import Concat
+
+from trytond import backend
+from trytond.cache import Cache, LRUDictTransaction
+from trytond.config import config
 from trytond.model import fields
 from trytond.pool import PoolMeta, Pool
+from trytond.tools import grouped_slice
+from trytond.transaction import Transaction
 
 __metaclass__ = PoolMeta
-__all__ = ['ShipmentOut', 'Move']
+__all__ = ['ShipmentOut', 'Move', 'Location']
 
 
 class ShipmentOut:
@@ -18,16 +27,117 @@ class ShipmentOut:
         getter='get_sales', searcher='search_sales'
     )
 
-    def get_sales(self, name=None):
+    @classmethod
+    def get_sales(cls, shipments, name=None):
+        """
+        Returns sales associated with the shipments.
+
+        The sales are computed with one query for all the shipments and
+        kept for the rest of the transaction.
+        """
+        cache = cls._get_sales_cache()
+        sales = dict(
+            (s.id, cache[s.id]) for s in shipments if s.id in cache
+        )
+        missing = [s.id for s in shipments if s.id not in sales]
+        if missing:
+            computed = cls._query_sales(missing)
+            cache.update(computed)
+            sales.update(computed)
+        return sales
+
+    @classmethod
+    def _get_sales_cache(cls):
         """
-        Returns sales associated with a shipment.
+        Returns the cache of the sales of the shipments in the transaction.
+        It is cleared by any write in the transaction.
         """
-        sales = set([m.sale.id for m in self.moves if m.sale])
-        return list(sales)
+        cache = Transaction().get_cache().setdefault(
+            '%s.sales' % cls.__name__,
+            LRUDictTransaction(config.getint('cache', 'record'))
+        )
+        cache.refresh()
+        return cache
+
+    @classmethod
+    def _query_sales(cls, shipment_ids):
+        """
+        Returns the sale ids of the shipments from the sale lines the moves
+        of the shipments originate from.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        SaleLine = pool.get('sale.line')
+        move = Move.__table__()
+        sale_line = SaleLine.__table__()
+        cursor = Transaction().connection.cursor()
+
+        sales = dict((i, []) for i in shipment_ids)
+        for sub_ids in grouped_slice(shipment_ids):
+            cursor.execute(*move.join(
+                sale_line, condition=(
+                    move.origin == Concat(SaleLine.__name__ + ',', sale_line.id)
+                )
+            ).select(
+                move.shipment, sale_line.sale,
+                where=move.shipment.in_([
+                    '%s,%s' % (cls.__name__, i) for i in sub_ids
+                ]),
+                group_by=[move.shipment, sale_line.sale],
+                order_by=[sale_line.sale],
+            ))
+            for shipment, sale_id in cursor.fetchall():
+                sales[int(shipment.split(',')[1])].append(sale_id)
+        return sales
 
     @classmethod
     def search_sales(cls, name, clause):
-        return [('moves.sale',) + tuple(clause[1:])]
+        """
+        Search on sale ids with a query joining the move origins to the sale
+        lines. Other clauses are searched on the sale of the moves.
+        """
+        sale_ids = cls._sale_ids_from_clause(name, clause)
+        if sale_ids is None:
+            return [('moves.sale',) + tuple(clause[1:])]
+
+        pool = Pool()
+        Move = pool.get('stock.move')
+        SaleLine = pool.get('sale.line')
+        move = Move.__table__()
+        sale_line = SaleLine.__table__()
+        cursor = Transaction().connection.cursor()
+
+        shipment_ids = set()
+        for sub_ids in grouped_slice(sale_ids):
+            cursor.execute(*move.join(
+                sale_line, condition=(
+                    move.origin == Concat(SaleLine.__name__ + ',', sale_line.id)
+                )
+            ).select(
+                move.shipment,
+                where=sale_line.sale.in_(list(sub_ids))
+                & move.shipment.like(cls.__name__ + ',%'),
+                group_by=[move.shipment],
+            ))
+            shipment_ids.update(
+                int(shipment.split(',')[1]) for shipment, in cursor.fetchall()
+            )
+        return [('id', 'in', list(shipment_ids))]
+
+    @staticmethod
+    def _sale_ids_from_clause(name, clause):
+        """
+        Returns the sale ids searched by the clause or None if the clause
+        does not search on ids.
+        """
+        if clause[0] != name or clause[1] not in ('=', 'in'):
+            return None
+        value = clause[2]
+        if clause[1] == '=':
+            value = [value]
+        if not value or not all(isinstance(v, (int, long)) for v in value):
+            return None
+        return value
 
     def _get_inventory_move(self, move):
         """
@@ -54,18 +164,136 @@ class Move:
         fields.Many2One('sale.sale', 'Sale'), 'get_sale_order'
     )
 
-    def get_sale_order(self, name):
+    @classmethod
+    def __register__(cls, module_name):
+        TableHandler = backend.get('TableHandler')
+
+        super(Move, cls).__register__(module_name)
+
+        table = TableHandler(cls, module_name)
+
+        # Index used to search shipments on the sales of their moves
+        table.index_action(['origin', 'shipment'], action='add')
+
+    @classmethod
+    def create(cls, vlist):
+        moves = super(Move, cls).create(vlist)
+        cls.invalidate_stock_caches(moves)
+        return moves
+
+    @classmethod
+    def write(cls, *args):
+        """
+        Invalidate the ledger totals and the stock snapshots of the done
+        moves, before the write for the dates they leave and after it for
+        the moves done or the dates they get.
+        """
+        ids = [m.id for m in chain(*args[::2])]
+        cls.invalidate_stock_caches(cls.browse(ids))
+        super(Move, cls).write(*args)
+        cls.invalidate_stock_caches(cls.browse(ids))
+
+    @staticmethod
+    def invalidate_stock_caches(moves):
+        """
+        Delete the ledger totals and the stock snapshots made wrong by the
+        done moves
+        """
+        pool = Pool()
+        LedgerMonth = pool.get('product.ledger.month')
+        Snapshot = pool.get('stock.balance.snapshot')
+
+        LedgerMonth.invalidate(moves)
+        Snapshot.invalidate(moves)
+
+    @classmethod
+    def get_sale_order(cls, moves, name):
         """
-        Get sale order from move origin
+        Get sale order of the moves of customer shipments from the move
+        origin, with one read of the moves and one of the sale lines.
         """
         SaleLine = Pool().get('sale.line')
-        ShipmentOut = Pool().get('stock.shipment.out')
 
-        if not self.shipment:
+        line_ids = {}
+        for values in cls.read(
+                [m.id for m in moves],
+                ['shipment', 'origin', 'inventory_origin']):
+            line_id = cls._sale_line_from_origin(values)
+            if line_id is not None:
+                line_ids[values['id']] = line_id
+
+        sales = dict(
+            (line['id'], line['sale']) for line in SaleLine.read(
+                list(set(line_ids.values())), ['sale']
+            )
+        )
+        return dict(
+            (m.id, sales.get(line_ids.get(m.id))) for m in moves
+        )
+
+    @staticmethod
+    def _sale_line_from_origin(values):
+        """
+        Returns the id of the sale line the values of a move read originate
+        from, if the move belongs to a customer shipment.
+        """
+        shipment = values['shipment'] or ''
+        origin = values['origin'] or values['inventory_origin'] or ''
+        if not shipment.startswith('stock.shipment.out,') or \
+                not origin.startswith('sale.line,'):
+            return None
+        try:
+            line_id = int(origin.split(',', 1)[1])
+        except ValueError:
             return None
+        if line_id >= 0:
+            return line_id
 
-        origin = self.origin or self.inventory_origin
 
-        if isinstance(self.shipment, ShipmentOut) and \
-                isinstance(origin, SaleLine):
-            return origin.sale.id
+class Location:
+    __name__ = 'stock.location'
+
+    pick_sequence = fields.Integer(
+        'Pick Sequence',
+        help='Order in which the location is visited on the pick path of '
+        'the warehouse.'
+    )
+
+    _pick_ranks_cache = Cache('stock.location.pick_ranks', context=False)
+
+    @classmethod
+    def get_pick_ranks(cls, warehouse_id):
+        """
+        Returns a dictionary of the ids of the locations of the warehouse to
+        their rank on the pick path. Locations are ranked on their pick
+        sequence, those without sequence coming last, and then on name.
+        """
+        ranks = cls._pick_ranks_cache.get(warehouse_id)
+        if ranks is not None:
+            return ranks
+
+        rows = cls.read(
+            map(int, cls.search([('parent', 'child_of', [warehouse_id])])),
+            ['pick_sequence', 'name']
+        )
+        rows.sort(key=lambda r: (
+            r['pick_sequence'] is None, r['pick_sequence'], r['name'], r['id']
+        ))
+        ranks = dict((r['id'], rank) for rank, r in enumerate(rows))
+        cls._pick_ranks_cache.set(warehouse_id, ranks)
+        return ranks
+
+    @classmethod
+    def create(cls, vlist):
+        cls._pick_ranks_cache.clear()
+        return super(Location, cls).create(vlist)
+
+    @classmethod
+    def write(cls, *args):
+        cls._pick_ranks_cache.clear()
+        super(Location, cls).write(*args)
+
+    @classmethod
+    def delete(cls, locations):
+        cls._pick_ranks_cache.clear()
+        super(Location, cls).delete(locations)
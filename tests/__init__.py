@@ -4,6 +4,12 @@ import unittest
 import trytond.tests.test_tryton
 
 from test_shipment import TestShipment
+from test_pdf_pool import TestPDFPool
+from test_barcodes import TestBarcodes
+from test_pdf_cache import TestPDFCache
+from test_pdf_merge import TestPDFMerge
+from test_css_bundle import TestCSSBundle
+from test_ledger_export import TestLedgerExport
 
 
 def suite():
@@ -13,6 +19,12 @@ def suite():
     test_suite = trytond.tests.test_tryton.suite()
     test_suite.addTests([
         unittest.TestLoader().loadTestsFromTestCase(TestShipment),
+        unittest.TestLoader().loadTestsFromTestCase(TestPDFPool),
+        unittest.TestLoader().loadTestsFromTestCase(TestBarcodes),
+        unittest.TestLoader().loadTestsFromTestCase(TestPDFCache),
+        unittest.TestLoader().loadTestsFromTestCase(TestPDFMerge),
+        unittest.TestLoader().loadTestsFromTestCase(TestCSSBundle),
+        unittest.TestLoader().loadTestsFromTestCase(TestLedgerExport),
     ])
     return test_suite
 
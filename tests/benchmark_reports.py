@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the reports on generated warehouse data.
+
+The shipments, their moves and the ledger history are generated on top of
+the data of ``BaseTestCase.setup_defaults``. Every report is executed on
+them and the time and number of queries of its phases, as recorded by
+ReportMixin, are written as JSON so that runs can be compared::
+
+    TRYTOND_DATABASE_URI=sqlite:// DB_NAME=:memory: \\
+        python tests/benchmark_reports.py --shipments 100 --moves 20 \\
+        --products 50 --days 30 --output baseline.json
+
+    python tests/benchmark_reports.py ... --compare baseline.json
+
+PostgreSQL is used with ``TRYTOND_DATABASE_URI=postgresql://...`` and a
+DB_NAME of a database to create. PDF conversion is skipped unless --pdf
+is given.
+"""
+import sys
+import json
+import logging
+import argparse
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+
+from trytond.tests.test_tryton import POOL, with_transaction
+from trytond.transaction import Transaction
+from trytond.pool import Pool
+
+from test_base import BaseTestCase
+
+SETTINGS = {
+    'shipments': 10,
+    'moves': 5,
+    'products': 10,
+    'days': 10,
+    'repeat': 3,
+    'pdf': False,
+    'output': None,
+    'compare': None,
+}
+
+#: Reports on the customer shipments
+SHIPMENT_REPORTS = [
+    'report.picking_list',
+    'report.consolidated_picking_list',
+    'report.delivery_note',
+]
+
+
+class StatsHandler(logging.Handler):
+    """
+    Collect the statistics logged by the reports
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.stats = []
+
+    def emit(self, record):
+        self.stats.append(json.loads(record.args[0]))
+
+
+class BenchmarkReports(BaseTestCase):
+    """
+    Benchmark the reports on generated data
+    """
+
+    def create_products(self, count):
+        """
+        Create count products
+        """
+        templates = self.ProductTemplate.create([{
+            'name': 'Product %05d' % index,
+            'type': 'goods',
+            'list_price': Decimal('10'),
+            'cost_price': Decimal('5'),
+            'default_uom': self.uom.id,
+            'products': [('create', [{
+                'code': 'P%05d' % index,
+            }])],
+        } for index in xrange(count)])
+        return [t.products[0] for t in templates]
+
+    def create_locations(self, warehouse, count):
+        """
+        Create count storage locations in the warehouse
+        """
+        return self.StockLocation.create([{
+            'name': 'Shelf %03d' % index,
+            'type': 'storage',
+            'parent': warehouse.storage_location.id,
+            'pick_sequence': index,
+        } for index in xrange(count)])
+
+    def create_shipments(self, warehouse, products, locations, count, moves):
+        """
+        Create count customer shipments with moves inventory moves each
+        """
+        Date = POOL.get('ir.date')
+
+        shipments = self.ShipmentOut.create([{
+            'planned_date': Date.today(),
+            'customer': self.party.id,
+            'warehouse': warehouse.id,
+            'delivery_address': self.party.addresses[0].id,
+        } for index in xrange(count)])
+        self.Move.create([{
+            'shipment': str(shipment),
+            'product': products[(index + offset) % len(products)].id,
+            'uom': self.uom.id,
+            'quantity': 1 + offset % 3,
+            'from_location': locations[
+                (index + offset) % len(locations)
+            ].id,
+            'to_location': warehouse.output_location.id,
+        } for index, shipment in enumerate(shipments)
+            for offset in xrange(moves)])
+        return shipments
+
+    def create_ledger_history(self, warehouse, products, days):
+        """
+        Create a done purchase and customer move per product and per day
+        """
+        Date = POOL.get('ir.date')
+
+        supplier, = self.StockLocation.search([('type', '=', 'supplier')])
+        # Customer moves must have an origin
+        sale, = self.Sale.create([{
+            'party': self.party.id,
+            'invoice_address': self.party.addresses[0].id,
+            'shipment_address': self.party.addresses[0].id,
+            'lines': [('create', [{
+                'type': 'line',
+                'unit_price': 10,
+                'quantity': 1,
+                'description': 'Line',
+                'unit': self.uom.id,
+            }])],
+        }])
+        today = Date.today()
+        vlist = []
+        for day in xrange(days):
+            date = today - timedelta(days=day)
+            for product in products:
+                vlist.append({
+                    'from_location': supplier.id,
+                    'to_location': warehouse.input_location.id,
+                    'product': product.id,
+                    'uom': self.uom.id,
+                    'quantity': 10,
+                    'unit_price': Decimal('5'),
+                    'effective_date': date,
+                })
+                vlist.append({
+                    'from_location': warehouse.storage_location.id,
+                    'to_location': self.party.customer_location.id,
+                    'product': product.id,
+                    'uom': self.uom.id,
+                    'quantity': 3,
+                    'unit_price': Decimal('10'),
+                    'effective_date': date,
+                    'origin': str(sale.lines[0]),
+                })
+        moves = self.Move.create(vlist)
+        self.Move.assign(moves)
+        self.Move.do(moves)
+
+    def execute(self, report_name, ids, data, handler):
+        """
+        Execute the report and return the statistics of the fastest run
+        """
+        Report = POOL.get(report_name, type='report')
+
+        Pool.test = not SETTINGS['pdf']
+        try:
+            del handler.stats[:]
+            for index in xrange(SETTINGS['repeat']):
+                Report.execute(ids, data)
+        finally:
+            Pool.test = True
+        return min(handler.stats, key=lambda s: s['duration'])
+
+    def run_reports(self, warehouse, shipments, products, handler):
+        Date = POOL.get('ir.date')
+
+        results = {}
+        shipment_ids = [s.id for s in shipments]
+        for report_name in SHIPMENT_REPORTS:
+            results[report_name] = self.execute(report_name, shipment_ids, {
+                'model': 'stock.shipment.out',
+                'ids': shipment_ids,
+            }, handler)
+        results['report.product_ledger'] = self.execute(
+            'report.product_ledger', [], {
+                'products': [p.id for p in products],
+                'warehouses': [warehouse.id],
+                'start_date': (
+                    Date.today() - timedelta(days=SETTINGS['days'] // 2)
+                ),
+                'end_date': Date.today(),
+            }, handler)
+        return results
+
+    @with_transaction()
+    def test_reports(self):
+        handler = StatsHandler()
+        logger = logging.getLogger(
+            'trytond.modules.report_html_stock.report_html_stock'
+        )
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.removeHandler, handler)
+
+        self.setup_defaults()
+
+        with Transaction().set_context(company=self.company.id):
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            products = self.create_products(SETTINGS['products'])
+            locations = self.create_locations(warehouse, 10)
+            shipments = self.create_shipments(
+                warehouse, products, locations,
+                SETTINGS['shipments'], SETTINGS['moves']
+            )
+            self.create_ledger_history(
+                warehouse, products, SETTINGS['days']
+            )
+            results = self.run_reports(
+                warehouse, shipments, products, handler
+            )
+
+        write_baseline({
+            'settings': dict(
+                (k, v) for k, v in SETTINGS.items()
+                if k not in ('output', 'compare')
+            ),
+            'database': Transaction().database.__class__.__module__,
+            'reports': results,
+        })
+
+
+def write_baseline(baseline):
+    output = json.dumps(baseline, indent=2, sort_keys=True)
+    if SETTINGS['output']:
+        with open(SETTINGS['output'], 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+    if SETTINGS['compare']:
+        with open(SETTINGS['compare']) as baseline_file:
+            compare(json.load(baseline_file), baseline)
+
+
+def compare(old, new):
+    """
+    Write the change of duration and queries of the reports between the
+    baselines
+    """
+    if old['settings'] != new['settings']:
+        sys.stderr.write('Warning: the baselines have different settings\n')
+    for report_name in sorted(new['reports']):
+        if report_name not in old['reports']:
+            continue
+        before = old['reports'][report_name]
+        after = new['reports'][report_name]
+        sys.stderr.write(
+            '%s: %.1fms -> %.1fms (%+.0f%%), %d -> %d queries\n' % (
+                report_name,
+                before['duration'] * 1000, after['duration'] * 1000,
+                (after['duration'] / (before['duration'] or 1) - 1) * 100,
+                before['total_queries'], after['total_queries'],
+            )
+        )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the reports on generated data'
+    )
+    parser.add_argument('--shipments', type=int)
+    parser.add_argument('--moves', type=int, help='moves per shipment')
+    parser.add_argument('--products', type=int)
+    parser.add_argument('--days', type=int, help='days of ledger history')
+    parser.add_argument('--repeat', type=int, help='executions per report')
+    parser.add_argument(
+        '--pdf', action='store_true', default=None,
+        help='convert the reports to PDF'
+    )
+    parser.add_argument('--output', help='file to write the baseline to')
+    parser.add_argument('--compare', help='baseline to compare with')
+    options = parser.parse_args()
+    SETTINGS.update(
+        (k, v) for k, v in vars(options).items() if v is not None
+    )
+
+
+if __name__ == '__main__':
+    parse_arguments()
+    unittest.TextTestRunner(verbosity=2).run(
+        unittest.TestLoader().loadTestsFromTestCase(BenchmarkReports)
+    )
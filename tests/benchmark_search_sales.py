@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Compare searching customer shipments on their sales with the searcher of
+ShipmentOut.sales and with the domain on the sale of the moves.
+
+Run with::
+
+    TRYTOND_DATABASE_URI=sqlite:// DB_NAME=:memory: \\
+        python tests/benchmark_search_sales.py [shipments]
+"""
+import sys
+import time
+import unittest
+
+from trytond.tests.test_tryton import POOL, with_transaction
+from trytond.transaction import Transaction
+
+from test_base import BaseTestCase
+
+SHIPMENTS = 500
+
+
+class BenchmarkSearchSales(BaseTestCase):
+    """
+    Benchmark searching shipments on sales
+    """
+
+    def create_shipments(self, count):
+        """
+        Create count sales, each with a shipment
+        """
+        Date = POOL.get('ir.date')
+
+        warehouse, = self.StockLocation.search([('type', '=', 'warehouse')])
+        sales = self.Sale.create([{
+            'party': self.party.id,
+            'invoice_address': self.party.addresses[0].id,
+            'shipment_address': self.party.addresses[0].id,
+            'lines': [('create', [{
+                'type': 'line',
+                'unit_price': 20,
+                'quantity': 1,
+                'description': 'Line',
+                'unit': self.uom.id,
+            }])],
+        } for i in xrange(count)])
+        shipments = self.ShipmentOut.create([{
+            'planned_date': Date.today(),
+            'customer': self.party.id,
+            'warehouse': warehouse.id,
+            'delivery_address': self.party.addresses[0].id,
+        } for i in xrange(count)])
+        self.Move.create([{
+            'shipment': str(shipment),
+            'origin': str(sale.lines[0]),
+            'product': self.product.id,
+            'uom': self.uom.id,
+            'quantity': 1,
+            'unit_price': 20,
+            'from_location': warehouse.output_location.id,
+            'to_location': self.party.customer_location.id,
+        } for sale, shipment in zip(sales, shipments)])
+        return sales
+
+    def timeit(self, domain, repeat=20):
+        start = time.time()
+        for i in xrange(repeat):
+            result = self.ShipmentOut.search(domain)
+        return (time.time() - start) / repeat, result
+
+    @with_transaction()
+    def test_search_sales(self):
+        self.setup_defaults()
+
+        with Transaction().set_context(company=self.company.id):
+            sales = self.create_shipments(SHIPMENTS)
+            sale_ids = [s.id for s in sales[::10]]
+
+            searcher, expected = self.timeit([('sales', 'in', sale_ids)])
+            rewrite, result = self.timeit([('moves.sale', 'in', sale_ids)])
+
+        self.assertEqual(sorted(result), sorted(expected))
+        sys.stderr.write(
+            '\nsearch_sales on %d shipments: searcher %.2fms, '
+            'moves.sale domain %.2fms\n' % (
+                SHIPMENTS, searcher * 1000, rewrite * 1000
+            )
+        )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        SHIPMENTS = int(sys.argv.pop(1))
+    unittest.TextTestRunner(verbosity=2).run(
+        unittest.TestLoader().loadTestsFromTestCase(BenchmarkSearchSales)
+    )
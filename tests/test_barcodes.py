@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import trytond.tests.test_tryton
+
+from trytond.modules.report_html_stock.barcodes import barcode, \
+    code128_values, qrcode
+
+
+class TestBarcodes(unittest.TestCase):
+    """
+    Test the server side barcode rendering
+    """
+
+    def test_0010_code128_values(self):
+        """
+        Test the code 128 symbols and checksum
+        """
+        # Code set B: (104 + 1 * 33 + 2 * 34 + 3 * 35) % 103 = 1
+        self.assertEqual(code128_values('ABC'), [104, 33, 34, 35, 1])
+
+        # Code set C for even length numbers
+        self.assertEqual(code128_values('1234'), [105, 12, 34, 82])
+
+        self.assertRaises(ValueError, code128_values, u'Caf\xe9')
+
+    def test_0020_barcode_filter(self):
+        """
+        Test the barcode jinja filter
+        """
+        svg = barcode('OS1')
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('OS1</text>', svg)
+
+        # Rendered barcodes are cached
+        self.assertIs(barcode('OS1'), svg)
+        self.assertIsNot(barcode('OS1', show_text=False), svg)
+
+        self.assertEqual(barcode(None), '')
+
+    @unittest.skipIf(qrcode is None, 'qrcode is not installed')
+    def test_0030_qrcode(self):
+        """
+        Test rendering of QR codes
+        """
+        svg = barcode('OS1', 'qr')
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('<rect', svg)
+
+
+def suite():
+    "Define suite"
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestBarcodes)
+    )
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import unittest
+
+import trytond.tests.test_tryton
+
+from trytond.modules.report_html_stock.css_bundle import used_names, \
+    purge, build, DIRECTORY, SOURCES, BUNDLE
+
+
+class TestCSSBundle(unittest.TestCase):
+    """
+    Test the purged stylesheet of the reports
+    """
+
+    def test_0010_used_names(self):
+        """
+        Test collecting the classes, ids and elements of the templates
+        """
+        classes, ids, tags = used_names([
+            '<div class="row {% if not first %}page-break{% endif %}">'
+            '<table id="moves" class=\'table\'></table></div>'
+        ])
+        self.assertTrue(set(['row', 'page-break', 'table']) <= classes)
+        self.assertEqual(ids, set(['moves']))
+        self.assertTrue(set(['div', 'table']) <= tags)
+
+    def test_0020_purge(self):
+        """
+        Test that only the rules matching the used names are kept
+        """
+        css = (
+            '/* comment */@charset "UTF-8";'
+            '.row,.btn{margin:0}'
+            'table td.text-right:hover{text-align:right}'
+            'a{color:red}'
+            '#moves{color:blue}'
+            'tr:nth-child(odd){background:#eee}'
+            '@media print{.btn{display:none}.row{display:block}}'
+            '@media print{a{color:#000}}'
+            '@font-face{font-family:Icons;src:url(icons.woff)}'
+            '@keyframes spin{from{top:0}to{top:1px}}'
+        )
+        self.assertEqual(
+            purge(
+                css, set(['row', 'text-right']), set(),
+                set(['table', 'td', 'tr'])
+            ),
+            '.row{margin:0}'
+            'table td.text-right:hover{text-align:right}'
+            'tr:nth-child(odd){background:#eee}'
+            '@media print{.row{display:block}}'
+        )
+
+    def test_0030_bundle(self):
+        """
+        Test the bundle is built from the current templates and is much
+        smaller than the stylesheets it is built from
+        """
+        with open(os.path.join(DIRECTORY, BUNDLE)) as bundle_file:
+            bundle = bundle_file.read()
+        self.assertEqual(
+            bundle, build(), 'Run python css_bundle.py to update the bundle'
+        )
+        sources_size = sum(
+            os.path.getsize(os.path.join(DIRECTORY, s)) for s in SOURCES
+        )
+        self.assertTrue(len(bundle) * 10 < sources_size)
+        for rule in ['.col-xs-6{', '.table{', '.pull-right{', '.row{']:
+            self.assertIn(rule, bundle)
+
+
+def suite():
+    "Define suite"
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestCSSBundle)
+    )
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import datetime
+
+import trytond.tests.test_tryton
+
+from trytond.modules.report_html_stock.ledger_export import export, \
+    xlsxwriter
+
+COLUMNS = ['date', 'product', 'quantity', 'origin']
+ROWS = [
+    (datetime.date(2016, 1, 31), u'Caf\xe9', 2.0, None),
+    (datetime.date(2016, 2, 1), u'Tea', 1.5, u'SO1'),
+]
+
+
+class TestLedgerExport(unittest.TestCase):
+    """
+    Test the writers of the exported ledger rows
+    """
+
+    def test_0010_csv(self):
+        """
+        Test the rows are written as utf-8 csv after the header
+        """
+        self.assertEqual(
+            export(iter(ROWS), COLUMNS, 'csv').splitlines(), [
+                'date,product,quantity,origin',
+                '2016-01-31,Caf\xc3\xa9,2.0,',
+                '2016-02-01,Tea,1.5,SO1',
+            ]
+        )
+
+    def test_0020_jsonl(self):
+        """
+        Test each row is written as a JSON object on its own line
+        """
+        lines = export(iter(ROWS), COLUMNS, 'jsonl').splitlines()
+        self.assertEqual(map(json.loads, lines), [{
+            'date': '2016-01-31',
+            'product': u'Caf\xe9',
+            'quantity': 2.0,
+            'origin': None,
+        }, {
+            'date': '2016-02-01',
+            'product': u'Tea',
+            'quantity': 1.5,
+            'origin': u'SO1',
+        }])
+
+    def test_0030_generator(self):
+        """
+        Test the rows are consumed one by one
+        """
+        consumed = []
+
+        def rows():
+            for row in ROWS:
+                consumed.append(row)
+                yield row
+
+        export(rows(), COLUMNS, 'csv')
+        self.assertEqual(consumed, ROWS)
+
+    @unittest.skipIf(xlsxwriter is None, 'xlsxwriter is not installed')
+    def test_0040_xlsx(self):
+        """
+        Test the rows are written as an XLSX workbook
+        """
+        content = export(iter(ROWS), COLUMNS, 'xlsx')
+        # XLSX files are zip archives
+        self.assertTrue(content.startswith('PK'))
+
+
+def suite():
+    "Define suite"
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestLedgerExport)
+    )
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import trytond.tests.test_tryton
+
+from trytond.modules.report_html_stock.pdf_cache import DiskCache
+
+
+class TestPDFCache(unittest.TestCase):
+    """
+    Test the on-disk cache of rendered reports
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_0010_get_set(self):
+        """
+        Test storing and reading entries
+        """
+        cache = DiskCache(self.path, 1024)
+
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', '%PDF-a')
+        self.assertEqual(cache.get('a'), '%PDF-a')
+        cache.set('a', '%PDF-b')
+        self.assertEqual(cache.get('a'), '%PDF-b')
+        self.assertEqual(os.listdir(self.path), ['a'])
+
+    def test_0020_evict(self):
+        """
+        Test that the least recently used entries are evicted
+        """
+        cache = DiskCache(self.path, 25)
+
+        for index, key in enumerate(['a', 'b']):
+            cache.set(key, key * 10)
+            # Make the order of the entries independent of the resolution
+            # of the file system timestamps
+            os.utime(os.path.join(self.path, key), (index, index))
+        os.utime(os.path.join(self.path, 'a'), (5, 5))
+
+        cache.set('c', 'c' * 10)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'a' * 10)
+        self.assertEqual(cache.get('c'), 'c' * 10)
+
+        cache.clear()
+        self.assertEqual(os.listdir(self.path), [])
+
+
+def suite():
+    "Define suite"
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestPDFCache)
+    )
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
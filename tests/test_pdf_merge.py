@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+from io import BytesIO
+
+import trytond.tests.test_tryton
+
+from trytond.modules.report_html_stock.pdf_merge import PyPDF2, \
+    count_pages, convert_chunks, split_numbered
+
+
+def blank_pdf(pages):
+    writer = PyPDF2.PdfFileWriter()
+    for index in range(pages):
+        writer.addBlankPage(612, 792)
+    result = BytesIO()
+    writer.write(result)
+    return result.getvalue()
+
+
+@unittest.skipIf(PyPDF2 is None, 'PyPDF2 is not installed')
+class TestPDFMerge(unittest.TestCase):
+    """
+    Test the conversion of reports in chunks
+    """
+
+    def test_0010_split_numbered(self):
+        """
+        Test the headers and footers showing page numbers are left out of
+        the conversion
+        """
+        self.assertEqual(
+            split_numbered({
+                'footer-left': 'Openlabs',
+                'footer-right': '[page]/[toPage]',
+                'footer-line': '',
+            }), ({
+                'footer-left': 'Openlabs',
+                'footer-line': '',
+            }, {
+                'footer-right': '[page]/[toPage]',
+            })
+        )
+
+    def test_0020_convert_chunks(self):
+        """
+        Test the chunks are converted once in parallel, merged in order and
+        numbered
+        """
+        calls = []
+        lock = threading.Lock()
+
+        def convert(data, options):
+            # The html of the fake documents is their number of pages
+            with lock:
+                calls.append((data, options))
+            return blank_pdf(int(data))
+
+        content = convert_chunks(
+            iter(['2', '3', '1']), {
+                'footer-left': 'Openlabs',
+                'footer-right': 'Page [page]/[toPage]',
+            }, convert, 2
+        )
+        self.assertEqual(count_pages(content), 6)
+        self.assertEqual(sorted(calls), [
+            ('1', {'footer-left': 'Openlabs'}),
+            ('2', {'footer-left': 'Openlabs'}),
+            ('3', {'footer-left': 'Openlabs'}),
+        ])
+        reader = PyPDF2.PdfFileReader(BytesIO(content))
+        self.assertEqual([
+            reader.getPage(index).extractText().strip()
+            for index in range(reader.getNumPages())
+        ], ['Page %s/6' % number for number in range(1, 7)])
+
+        # Chunks without page numbers are merged as converted
+        del calls[:]
+        content = convert_chunks(
+            iter(['2', '3']), {'footer-right': 'Openlabs'}, convert, 2
+        )
+        self.assertEqual(count_pages(content), 5)
+        self.assertEqual(sorted(calls), [
+            ('2', {'footer-right': 'Openlabs'}),
+            ('3', {'footer-right': 'Openlabs'}),
+        ])
+
+
+def suite():
+    "Define suite"
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestPDFMerge)
+    )
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import unittest
+
+import trytond.tests.test_tryton
+
+from trytond.modules.report_html_stock.pdf_pool import WorkerPool, \
+    PoolTimeout, RenderError, Worker, quote, exit_code
+
+# Fake wkhtmltopdf writing the output of every job like wkhtmltopdf on load
+# errors: the documents containing "fail" fail the page with an error
+# before Done and the others containing "warn" only warn. Both are followed
+# by an exit line after Done, delayed for "late".
+FAKE_WKHTMLTOPDF = """
+import sys, time
+for line in iter(sys.stdin.readline, ''):
+    source, output = line.split()[-2:]
+    data = open(source).read()
+    open(output, 'w').write('%PDF ' + data)
+    sys.stderr.write('Loading pages (1/6)\\n')
+    if 'fail' in data:
+        sys.stderr.write('Error: Failed loading page file://x\\n')
+    elif 'warn' in data:
+        sys.stderr.write('Warning: Failed to load file://y (ignore)\\n')
+    sys.stderr.write('[====] 100%\\rDone\\n')
+    sys.stderr.flush()
+    if 'fail' in data or 'warn' in data:
+        if 'late' in data:
+            time.sleep(0.5)
+        sys.stderr.write('Exit with code 1 due to network error: Host\\n')
+        sys.stderr.flush()
+"""
+
+
+class FakeWorker(Worker):
+    command = [sys.executable, '-c', FAKE_WKHTMLTOPDF]
+
+
+class TestPDFPool(unittest.TestCase):
+    """
+    Test the pool of wkhtmltopdf workers
+    """
+
+    def test_0010_quote(self):
+        """
+        Test quoting of the option values written to the workers
+        """
+        self.assertEqual(quote('openlabs'), '"openlabs"')
+        self.assertEqual(quote('Say "hi"'), '"Say \\"hi\\""')
+
+    def test_0015_exit_code(self):
+        """
+        Test detection of the end of a job in the wkhtmltopdf feedback
+        """
+        self.assertIsNone(exit_code('Loading pages (1/6)\n'))
+        self.assertEqual(exit_code('[======] 100%\rDone\n'), 0)
+        self.assertEqual(
+            exit_code('Exit with code 1 due to network error\n'), 1
+        )
+
+    def test_0017_worker_exit_line(self):
+        """
+        Test a job failing before Done raises, a late exit line of a job is
+        not taken as the result of the next one and the successful jobs
+        return at their Done
+        """
+        worker = FakeWorker()
+        self.addCleanup(worker.close)
+
+        self.assertEqual(worker.convert('ok', {}, 5), '%PDF ok')
+        self.assertRaises(RenderError, worker.convert, 'fail', {}, 5)
+        self.assertEqual(worker.convert('ok', {}, 5), '%PDF ok')
+        self.assertRaises(RenderError, worker.convert, 'fail late', {}, 5)
+        self.assertEqual(worker.convert('ok', {}, 5), '%PDF ok')
+
+        # The exit line of a warning comes while the next job runs
+        self.assertEqual(worker.convert('warn late', {}, 5), '%PDF warn late')
+        self.assertEqual(worker.convert('ok', {}, 5), '%PDF ok')
+
+        start = time.time()
+        for _ in range(5):
+            worker.convert('ok', {}, 5)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_0020_queue_timeout(self):
+        """
+        Test that waiting for a busy pool times out
+        """
+        pool = WorkerPool(1, queue_timeout=0.01)
+
+        # Hold the only slot of the pool
+        pool.slots.get()
+        self.assertRaises(PoolTimeout, pool.convert, '<html/>', {})
+
+    def test_0030_recycle(self):
+        """
+        Test that workers are dropped after max_jobs conversions
+        """
+        class FakeWorker(object):
+            jobs = 2
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        pool = WorkerPool(1, max_jobs=2)
+        pool.slots.get()
+
+        worker = FakeWorker()
+        pool.release(worker)
+        self.assertTrue(worker.closed)
+        self.assertIsNone(pool.slots.get_nowait())
+
+
+def suite():
+    "Define suite"
+    test_suite = trytond.tests.test_tryton.suite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestPDFPool)
+    )
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
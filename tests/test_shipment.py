@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
+import json
+import logging
+import shutil
+import tempfile
 import unittest
+from io import BytesIO
+from itertools import chain
+from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
 import trytond.tests.test_tryton
@@ -8,8 +16,14 @@ from trytond.tests.test_tryton import POOL, ModuleTestCase, \
     with_transaction
 from trytond.transaction import Transaction
 from trytond.pool import Pool
+from trytond.config import config
+from trytond.exceptions import UserError
+
+from trytond.modules.report_html_stock.pdf_cache import get_cache
+from trytond.modules.report_html_stock.instrumentation import ReportStats
 
 from test_base import BaseTestCase
+from test_pdf_merge import PyPDF2, blank_pdf
 
 
 class TestShipment(BaseTestCase, ModuleTestCase):
@@ -568,6 +582,31 @@ class TestShipment(BaseTestCase, ModuleTestCase):
             # start_date) are ignored
             self.assertEqual(len(consumed), 2)
 
+            # All the buckets are fetched with one search
+            ledger_moves = LedgerReport.get_ledger_moves(
+                [self.product.id], data
+            )[self.product.id]
+            self.assertEqual(ledger_moves['purchases'], purchases)
+            self.assertEqual(ledger_moves['productions'], productions)
+            self.assertEqual(ledger_moves['customers'], customers)
+            self.assertEqual(
+                ledger_moves['lost_and_founds'], lost_and_founds
+            )
+            self.assertEqual(ledger_moves['consumed'], consumed)
+
+            # The overrides of the getters with the former signature
+            LedgerReport.get_purchases = classmethod(
+                lambda cls, product_id, data: ['override']
+            )
+            try:
+                ledger_record = LedgerReport.get_record(
+                    self.product, data, ledger_moves
+                )
+            finally:
+                del LedgerReport.get_purchases
+            self.assertEqual(ledger_record['purchases'], ['override'])
+            self.assertEqual(ledger_record['consumed'], consumed)
+
             record = {
                 'purchases': purchases,
                 'productions': productions,
@@ -589,6 +628,121 @@ class TestShipment(BaseTestCase, ModuleTestCase):
             self.assertEqual(result['opening_stock'], 1)
             self.assertEqual(result['closing_stock'], 5)
 
+            balances = LedgerReport.get_stock_balances([self.product], data)
+            self.assertEqual(balances, {
+                self.product.id: {'opening_stock': 1, 'closing_stock': 5}
+            })
+
+            # The totals summed by the database match the moves
+            totals = LedgerReport.get_ledger_totals([self.product.id], data)
+            self.assertEqual(totals, {self.product.id: {
+                'purchased': 4,
+                'produced': 4,
+                'customer': 4,
+                'lost': 4,
+                'consumed': 4,
+            }})
+
+            # The summary only ledger has the same summary without moves
+            context = LedgerReport.get_context(
+                [], dict(data, summary_only=True)
+            )
+            record, = context['records']
+            self.assertEqual(record['product'], self.product)
+            self.assertEqual(record['purchases'], [])
+            self.assertEqual(
+                context['summary'][self.product], dict(
+                    result, opening_stock=1, closing_stock=5
+                )
+            )
+
+            # The moves summed per period and party with the balance
+            periods = LedgerReport.get_periods(
+                [self.product.id], dict(data, granularity='daily'),
+                {self.product.id: {'opening_stock': 1}}
+            )[self.product.id]
+            self.assertEqual(
+                [p['start'] for p in periods], [
+                    today - relativedelta(days=10),
+                    today - relativedelta(days=5),
+                ]
+            )
+            self.assertEqual(periods[0]['lines'][2], {
+                'bucket': 'customers',
+                'party': self.party.rec_name,
+                'quantity': 2,
+            })
+            self.assertEqual(len(periods[0]['lines']), 5)
+            self.assertEqual(periods[-1]['balance'], 5)
+
+            periods = LedgerReport.get_periods(
+                [self.product.id], dict(data, granularity='monthly'),
+                {self.product.id: {'opening_stock': 1}}
+            )[self.product.id]
+            self.assertEqual(periods[-1]['end'], data['end_date'])
+            self.assertEqual(periods[-1]['balance'], 5)
+            self.assertEqual(
+                sum(
+                    line['quantity']
+                    for p in periods for line in p['lines']
+                ), 20
+            )
+
+            context = LedgerReport.get_context(
+                [], dict(data, granularity='weekly')
+            )
+            record, = context['records']
+            self.assertEqual(record['customers'], [])
+            self.assertTrue(record['periods'])
+            val = LedgerReport.execute([], dict(data, granularity='weekly'))
+            self.assertIn('Movements', bytes(val[1]))
+
+            # The values of the detail tables are read for all the moves
+            details = LedgerReport.get_move_details(customers + purchases)
+            self.assertEqual(details[customers[0].id], {
+                'party': self.party.rec_name,
+                'reference': self.sale.reference,
+                'shipment': None,
+                'production': None,
+                'production_location': None,
+                'consumed': False,
+                'operator': None,
+            })
+            self.assertEqual(details[purchases[0].id]['party'], None)
+            context = LedgerReport.get_context([], data)
+            self.assertEqual(
+                sorted(context['details']),
+                sorted(m.id for m in chain(
+                    purchases, productions, customers, lost_and_founds,
+                    consumed
+                ))
+            )
+
+            # The export has a row per move and bucket, read by batches
+            rows = list(LedgerReport.iter_ledger_rows(data, batch_size=3))
+            self.assertEqual(len(rows), 10)
+            self.assertEqual(
+                [r[3] for r in rows if r[0] == today - relativedelta(days=5)],
+                [
+                    'purchases', 'productions', 'customers',
+                    'lost_and_founds', 'consumed',
+                ]
+            )
+            self.assertEqual(
+                [r[7] for r in rows if r[3] == 'customers'],
+                [sale_line.rec_name] * 2
+            )
+            self.assertEqual(list(LedgerReport.iter_ledger_rows(data)), rows)
+
+            LedgerExport = POOL.get(
+                'report.product_ledger_export', type='report'
+            )
+            oext, content, _, name = LedgerExport.execute(
+                [], dict(data, format='csv')
+            )
+            self.assertEqual(oext, 'csv')
+            self.assertEqual(len(bytes(content).splitlines()), 11)
+
     @with_transaction()
     @unittest.skipIf(sys.platform == 'darwin', 'wkhtmltopdf repo on OSX')
     def test_0110_test_consolidate_picking_list_report(self):
@@ -701,6 +855,904 @@ class TestShipment(BaseTestCase, ModuleTestCase):
             # Assert report name
             self.assertEqual(val[3], 'Delivery Note')
 
+    @with_transaction()
+    def test_0140_test_prefetch(self):
+        """
+        Test prefetching of the fields read by the templates
+        """
+        Report = POOL.get('report.picking_list', type="report")
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        with Transaction().set_context({'company': self.company.id}):
+            shipment, = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': self.StockLocation.search([
+                    ('type', '=', 'warehouse')
+                ])[0],
+                'delivery_address': self.party.addresses[0],
+            }])
+            self.Move.create([{
+                'shipment': ('stock.shipment.out', shipment.id),
+                'product': self.product.id,
+                'uom': self.uom.id,
+                'quantity': 6,
+                'from_location': shipment.warehouse.storage_location.id,
+                'to_location': shipment.warehouse.output_location.id,
+            }])
+
+            shipments = self.ShipmentOut.browse([shipment.id])
+            Report.prefetch(shipments, [
+                'inventory_moves.product.code',
+                # Fields of modules which are not installed are skipped
+                'carrier.party.name',
+            ])
+            product, = Report._prefetch_field(
+                Report._prefetch_field(shipments, 'inventory_moves'),
+                'product'
+            )
+            self.assertEqual(product, self.product)
+
+    @with_transaction()
+    def test_0150_test_move_sale_order(self):
+        """
+        Test sale order of the moves
+        """
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        with Transaction().set_context({'company': self.company.id}):
+            sale = self.Sale(
+                party=self.party,
+                invoice_address=self.party.addresses[0],
+                shipment_address=self.party.addresses[0],
+                lines=[],
+            )
+            sale.save()
+            sale_line, = self.SaleLine.create([{
+                'type': 'line',
+                'unit_price': 20,
+                'quantity': 1,
+                'description': "Test Sale",
+                'sale': sale,
+                'unit': self.uom,
+            }])
+            shipment, = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': self.StockLocation.search([
+                    ('type', '=', 'warehouse')
+                ])[0],
+                'delivery_address': self.party.addresses[0],
+            }])
+            values = {
+                'product': self.product.id,
+                'uom': self.uom.id,
+                'quantity': 1,
+                'from_location': shipment.warehouse.storage_location.id,
+                'to_location': shipment.warehouse.output_location.id,
+            }
+            origin = '%s,%d' % (sale_line.__name__, sale_line.id)
+            move1, move2, move3 = self.Move.create([
+                dict(values, shipment=str(shipment), origin=origin),
+                dict(values, shipment=str(shipment), inventory_origin=origin),
+                dict(values, origin=origin),
+            ])
+
+            self.assertEqual(
+                self.Move.get_sale_order([move1, move2, move3], 'sale_order'),
+                {move1.id: sale.id, move2.id: sale.id, move3.id: None}
+            )
+            self.assertEqual(move1.sale_order, sale)
+
+            # Only move1 originates from the sale line
+            self.assertEqual(
+                self.ShipmentOut.get_sales([shipment], 'sales'),
+                {shipment.id: [sale.id]}
+            )
+            self.assertEqual(
+                self.ShipmentOut.search([('sales', '=', sale.id)]),
+                [shipment]
+            )
+            self.assertEqual(
+                self.ShipmentOut.search([('sales', 'in', [sale.id])]),
+                [shipment]
+            )
+            # Searched through the moves
+            self.assertEqual(
+                self.ShipmentOut.search([('sales', '!=', None)]),
+                [shipment]
+            )
+
+            # The cached sales are dropped by writes
+            sale2, = self.Sale.copy([sale])
+            sale_line2, = sale2.lines
+            self.Move.write([move3], {
+                'shipment': str(shipment),
+                'origin': str(sale_line2),
+            })
+            self.assertEqual(
+                self.ShipmentOut.get_sales([shipment], 'sales'),
+                {shipment.id: sorted([sale.id, sale2.id])}
+            )
+
+    @with_transaction()
+    def test_0160_test_consolidated_picking_list_stream(self):
+        """
+        Test streaming the moves of the consolidated picking list
+        """
+        Report = POOL.get('report.consolidated_picking_list', type="report")
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        with Transaction().set_context({'company': self.company.id}):
+            product2, = self.Product.create([{
+                'template': self.product_template.id,
+                'code': '456',
+            }])
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            shipments = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': warehouse.id,
+                'delivery_address': self.party.addresses[0],
+            } for i in range(2)])
+            self.Move.create([{
+                'shipment': str(shipment),
+                'product': product.id,
+                'uom': self.uom.id,
+                'quantity': quantity,
+                'from_location': warehouse.storage_location.id,
+                'to_location': warehouse.output_location.id,
+            } for shipment in shipments
+                for product, quantity in [(product2, 1), (self.product, 2)]
+            ])
+
+            grouped_moves = Report.get_grouped_moves(shipments)
+            self.assertEqual(len(grouped_moves), 2)
+            self.assertEqual(
+                [(k, list(m), q) for k, m, q in Report.stream_grouped_moves(
+                    self.ShipmentOut.browse(map(int, shipments))
+                )],
+                grouped_moves
+            )
+            self.assertEqual(grouped_moves[0][2], 4)
+
+            val = Report.execute(map(int, shipments), {'stream': True})
+            self.assertEqual(val[3], 'Consolidated Picking List')
+            # The group total is in the default unit of the product
+            self.assertIn(
+                '<b>4.0 %s</b> x' % self.uom.symbol, bytes(val[1])
+            )
+
+            # A customised grouping is never streamed
+            class CustomReport(Report):
+                @classmethod
+                def group_key(cls, move):
+                    return (move.product,)
+
+            self.assertTrue(Report.can_stream())
+            self.assertFalse(CustomReport.can_stream())
+            self.assertTrue(Report.is_streamed([None] * 500, {}))
+            self.assertFalse(CustomReport.is_streamed([None] * 500, {}))
+            self.assertRaises(
+                UserError, CustomReport.is_streamed, shipments,
+                {'stream': True}
+            )
+
+    @with_transaction()
+    def test_0170_test_consolidated_picking_list_quantity(self):
+        """
+        Test the group quantities are in the default UOM of the product
+        """
+        Report = POOL.get('report.consolidated_picking_list', type="report")
+
+        self.setup_defaults()
+
+        dozen, = self.Uom.create([{
+            'name': 'Dozen',
+            'symbol': 'dz',
+            'category': self.uom.category.id,
+            'factor': 12,
+            'rate': round(1. / 12, 12),
+            'rounding': 1,
+            'digits': 0,
+        }])
+        warehouse, = self.StockLocation.search([('type', '=', 'warehouse')])
+
+        with Transaction().set_context({'company': self.company.id}):
+            moves = self.Move.create([{
+                'product': self.product.id,
+                'uom': uom.id,
+                'quantity': quantity,
+                'from_location': warehouse.storage_location.id,
+                'to_location': warehouse.output_location.id,
+            } for uom, quantity in [(self.uom, 2), (dozen, 1)]])
+            self.assertEqual(Report.get_group_quantity(moves), 14)
+
+            # Moves without internal quantity are converted
+            move = self.Move(
+                product=self.product, uom=dozen, quantity=2,
+                internal_quantity=None,
+            )
+            factors = {}
+            self.assertEqual(
+                Report.get_group_quantity(moves + [move], factors), 38
+            )
+            self.assertEqual(factors, {(dozen.id, self.uom.id): 12})
+
+    @with_transaction()
+    def test_0180_test_sort_keys(self):
+        """
+        Test the sort keys of the moves are read in bulk
+        """
+        Report = POOL.get('report.picking_list', type="report")
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        with Transaction().set_context({'company': self.company.id}):
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            shelf, = self.StockLocation.create([{
+                'name': 'A Shelf',
+                'type': 'storage',
+                'parent': warehouse.storage_location.id,
+            }])
+            shipment, = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': warehouse.id,
+                'delivery_address': self.party.addresses[0],
+            }])
+            move1, move2 = self.Move.create([{
+                'shipment': str(shipment),
+                'product': self.product.id,
+                'uom': self.uom.id,
+                'quantity': 1,
+                'from_location': location.id,
+                'to_location': warehouse.output_location.id,
+            } for location in [warehouse.storage_location, shelf]])
+
+            sort_keys = Report.get_sort_keys(
+                [move1, move2], ['from_location.rec_name', 'product.name']
+            )
+            self.assertEqual(sort_keys, {
+                move1.id: (
+                    warehouse.storage_location.rec_name, self.product.name
+                ),
+                move2.id: (shelf.rec_name, self.product.name),
+            })
+            self.assertEqual(
+                Report.sort_inventory_moves(
+                    shipment, lambda m: sort_keys[m.id]
+                ),
+                [move2, move1]
+            )
+
+    @with_transaction()
+    def test_0190_test_pick_path(self):
+        """
+        Test the moves are sorted and grouped on the pick path
+        """
+        Report = POOL.get('report.picking_list', type="report")
+        ConsolidatedReport = POOL.get(
+            'report.consolidated_picking_list', type="report"
+        )
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        with Transaction().set_context({'company': self.company.id}):
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            storage = warehouse.storage_location
+            shelf, = self.StockLocation.create([{
+                'name': 'A Shelf',
+                'type': 'storage',
+                'parent': storage.id,
+            }])
+            shipment, = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': warehouse.id,
+                'delivery_address': self.party.addresses[0],
+            }])
+            move1, move2 = self.Move.create([{
+                'shipment': str(shipment),
+                'product': self.product.id,
+                'uom': self.uom.id,
+                'quantity': 1,
+                'from_location': location.id,
+                'to_location': warehouse.output_location.id,
+            } for location in [storage, shelf]])
+            shipment = self.ShipmentOut(shipment.id)
+
+            # Without sequence the locations are ranked on their name
+            ranks = self.StockLocation.get_pick_ranks(warehouse.id)
+            self.assertTrue(ranks[shelf.id] < ranks[storage.id])
+
+            self.StockLocation.write([storage], {'pick_sequence': 10})
+            ranks = self.StockLocation.get_pick_ranks(warehouse.id)
+            self.assertTrue(ranks[storage.id] < ranks[shelf.id])
+            self.assertEqual(
+                Report.get_pick_path_sort_keys([shipment]), {
+                    move1.id: (ranks[storage.id], self.product.name),
+                    move2.id: (ranks[shelf.id], self.product.name),
+                }
+            )
+            self.assertEqual(
+                [key[0] for key, _, _ in ConsolidatedReport.get_grouped_moves(
+                    [shipment]
+                )],
+                [storage, shelf]
+            )
+            self.assertEqual(
+                [key[0] for key, _, _ in
+                    ConsolidatedReport.stream_grouped_moves([shipment])],
+                [storage, shelf]
+            )
+            key = ConsolidatedReport.group_key(move1)
+            self.assertEqual(key, (storage, self.product))
+            self.assertEqual(
+                ConsolidatedReport.get_location_repr_from(key),
+                storage.rec_name
+            )
+            self.assertEqual(
+                ConsolidatedReport.get_product_repr_from(key),
+                self.product.rec_name
+            )
+
+            # A customised grouping keeps its key and follows the pick path
+            class CustomReport(ConsolidatedReport):
+                @classmethod
+                def group_key(cls, move):
+                    return (move.from_location.name, move.product.id)
+
+            self.assertEqual(
+                [k for k, _, _ in CustomReport.get_grouped_moves([shipment])],
+                [
+                    (storage.name, self.product.id),
+                    (shelf.name, self.product.id),
+                ]
+            )
+
+            self.StockLocation.write([shelf], {'pick_sequence': 5})
+            ranks = self.StockLocation.get_pick_ranks(warehouse.id)
+            self.assertTrue(ranks[shelf.id] < ranks[storage.id])
+
+    @with_transaction()
+    def test_0200_test_report_cache(self):
+        """
+        Test reprints are served from the cache of rendered reports
+        """
+        Report = POOL.get('report.picking_list', type="report")
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        path = tempfile.mkdtemp()
+        if not config.has_section('report_html_stock'):
+            config.add_section('report_html_stock')
+        config.set('report_html_stock', 'pdf_cache_path', path)
+        self.addCleanup(shutil.rmtree, path)
+        self.addCleanup(
+            config.remove_option, 'report_html_stock', 'pdf_cache_path'
+        )
+
+        with Transaction().set_context({'company': self.company.id}):
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            shipment, = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': warehouse.id,
+                'delivery_address': self.party.addresses[0],
+            }])
+            move_values = {
+                'shipment': str(shipment),
+                'product': self.product.id,
+                'uom': self.uom.id,
+                'quantity': 1,
+                'from_location': warehouse.storage_location.id,
+                'to_location': warehouse.output_location.id,
+            }
+            self.Move.create([move_values])
+
+            oext, _, _, name = Report.execute([shipment.id], {})
+            self.assertEqual(name, 'Picking List')
+            self.assertEqual(len(os.listdir(path)), 1)
+
+            # A hit returns the cached content without rendering
+            key = Report.get_cache_key(
+                Report.get_action_report({}), [shipment.id], {}
+            )
+            self.assertEqual(os.listdir(path), [key])
+            get_cache().set(key, 'cached')
+            val = Report.execute([shipment.id], {})
+            self.assertEqual(val, (oext, bytearray('cached'), False, name))
+
+            # The report is rendered again when the moves change
+            self.Move.create([move_values])
+            val = Report.execute([shipment.id], {})
+            self.assertNotEqual(val[1], bytearray('cached'))
+            self.assertEqual(len(os.listdir(path)), 2)
+
+    @with_transaction()
+    def test_0210_test_report_job(self):
+        """
+        Test reports run in the background
+        """
+        ReportJob = POOL.get('report.job')
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        if not config.has_section('report_html_stock'):
+            config.add_section('report_html_stock')
+        config.set('report_html_stock', 'report_job_workers', '1')
+        self.addCleanup(
+            config.remove_option, 'report_html_stock', 'report_job_workers'
+        )
+
+        with Transaction().set_context({'company': self.company.id}):
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            shipment, = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': warehouse.id,
+                'delivery_address': self.party.addresses[0],
+            }])
+
+            job_ids = [
+                ReportJob.enqueue(
+                    'report.picking_list', [shipment.id],
+                    {'date': Date.today()}
+                )
+                for _ in range(2)
+            ]
+            first, second = ReportJob.browse(job_ids)
+            self.assertEqual(first.state, 'queued')
+            self.assertEqual(first.company, self.company)
+
+            # Only as many jobs as workers are claimed, oldest first
+            self.assertEqual(ReportJob.claim(), [first])
+            self.assertEqual(first.state, 'running')
+            self.assertEqual(second.state, 'queued')
+
+            first.run()
+            first = ReportJob(first.id)
+            self.assertEqual(first.state, 'done')
+            self.assertEqual(first.attachment.name, 'Picking List.pdf')
+            self.assertTrue(first.attachment.data)
+            self.assertEqual(first.attachment.resource, first)
+            self.assertTrue(first.duration is not None)
+
+            # The running jobs count against the workers until they are lost
+            self.assertEqual(ReportJob.claim(), [second])
+            self.assertEqual(ReportJob.claim(), [])
+            ReportJob.write([second], {
+                'started': datetime.now() - timedelta(hours=2),
+            })
+            self.assertEqual(ReportJob.claim(), [])
+            second = ReportJob(second.id)
+            self.assertEqual(second.state, 'failed')
+            self.assertTrue(second.error)
+
+            # The users only create jobs for themselves and only see theirs
+            user, = self.User.create([{
+                'name': 'Report User',
+                'login': 'report_user',
+            }])
+            with Transaction().set_user(user.id), \
+                    Transaction().set_context(_check_access=True):
+                self.assertRaises(UserError, ReportJob.create, [{
+                    'report': 'report.picking_list',
+                    'user': 1,
+                }])
+                job_id = ReportJob.enqueue(
+                    'report.picking_list', [shipment.id], {}
+                )
+                self.assertEqual(
+                    [j.id for j in ReportJob.search([])], [job_id]
+                )
+            self.assertEqual(ReportJob(job_id).user, user)
+
+    @with_transaction()
+    def test_0220_test_report_stats(self):
+        """
+        Test the phases of the report executions are timed and counted
+        """
+        Report = POOL.get('report.picking_list', type="report")
+        Statistic = POOL.get('report.statistic')
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger(
+            'trytond.modules.report_html_stock.report_html_stock'
+        )
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.removeHandler, handler)
+
+        with Transaction().set_context({'company': self.company.id}):
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            shipment, = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': warehouse.id,
+                'delivery_address': self.party.addresses[0],
+            }])
+
+            Report.execute([shipment.id], {})
+
+            record, = records
+            stats = json.loads(record.args[0])
+            self.assertEqual(stats['report'], 'report.picking_list')
+            self.assertEqual(stats['records'], 1)
+            self.assertEqual(
+                sorted(stats['durations']),
+                ['context', 'convert', 'execute', 'render']
+            )
+            self.assertTrue(stats['queries']['context'] > 0)
+            self.assertEqual(
+                stats['total_queries'], sum(stats['queries'].values())
+            )
+            self.assertTrue(stats['html_size'] > 0)
+            self.assertFalse(stats['cache_hit'])
+
+        # Nested phases are exclusive
+        stats = ReportStats('report.picking_list', 2)
+        with stats.collect():
+            with stats.phase('convert'):
+                with stats.phase('render'):
+                    self.Move.search([])
+        self.assertEqual(stats.queries, {'convert': 0, 'render': 1})
+        self.assertTrue(stats.durations['convert'] >= 0)
+
+        statistic, = Statistic.create_from_stats([stats])
+        self.assertEqual(statistic.report, 'report.picking_list')
+        self.assertEqual(statistic.records, 2)
+        self.assertEqual(statistic.render_queries, 1)
+        self.assertEqual(statistic.queries, 1)
+        self.assertEqual(statistic.context_queries, None)
+
+    @with_transaction()
+    def test_0230_test_company_header(self):
+        """
+        Test the company header is rendered once and cached until the
+        company or its party change
+        """
+        Report = POOL.get('report.picking_list', type="report")
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        self.Company.write([self.company], {
+            'header_html': (
+                '<p class="company">{{ company.party.name }}'
+                '{{ report }}{{ records }}</p>'
+            ),
+            'footer_html': '<i>{{ language }}</i>',
+        })
+        with Transaction().set_context({'company': self.company.id}):
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            shipments = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': warehouse.id,
+                'delivery_address': self.party.addresses[0],
+            } for _ in range(2)])
+            ids = map(int, shipments)
+
+            html = str(Report.execute(ids, {})[1])
+            self.assertEqual(
+                html.count('<p class="company">openlabs</p>'), 2
+            )
+            self.assertEqual(
+                Report.get_pdf_options()['footer-left'], 'openlabs'
+            )
+
+            self.Party.write([self.company.party], {'name': 'Fulfil.IO'})
+            html = str(Report.execute(ids, {})[1])
+            self.assertEqual(
+                html.count('<p class="company">Fulfil.IO</p>'), 2
+            )
+            self.assertEqual(
+                Report.get_pdf_options()['footer-left'], 'Fulfil.IO'
+            )
+
+            # The header and footer can also be included
+            html = Report.render_template(
+                '{% include header %}|{{ footer }}|{% include footer %}',
+                {'company': self.company}, None
+            )
+            self.assertEqual(
+                html,
+                '<p class="company">Fulfil.IO</p>|<i>en_US</i>|<i>en_US</i>'
+            )
+
+    @with_transaction()
+    def test_0240_test_stock_balance_snapshot(self):
+        """
+        The balances computed from the snapshots match the stock quantity
+        computation, also after backdated moves
+        """
+        Date = POOL.get('ir.date')
+        Location = POOL.get('stock.location')
+        StockMove = POOL.get('stock.move')
+        Product = POOL.get('product.product')
+        Snapshot = POOL.get('stock.balance.snapshot')
+
+        self.setup_defaults()
+
+        today = Date.today()
+        warehouse, = Location.search([('type', '=', 'warehouse')])
+        supplier, = Location.search([('type', '=', 'supplier')])
+        lost_found, = Location.search([('type', '=', 'lost_found')])
+
+        def move(from_location, to_location, quantity, days):
+            move, = StockMove.create([{
+                'from_location': from_location.id,
+                'to_location': to_location.id,
+                'quantity': quantity,
+                'product': self.product.id,
+                'uom': self.product.default_uom.id,
+                'unit_price': 20,
+                'effective_date': today - relativedelta(days=days),
+            }])
+            StockMove.assign([move])
+            StockMove.do([move])
+            return move
+
+        def check_balances():
+            for days in (40, 30, 20, 15, 10, 5, 1):
+                date = today - relativedelta(days=days)
+                with Transaction().set_context(
+                    locations=[warehouse.id], stock_date_end=date
+                ):
+                    quantity = Product.get_quantity(
+                        [self.product], 'quantity'
+                    )[self.product.id]
+                self.assertEqual(
+                    Snapshot.get_balances(
+                        [self.product.id], [warehouse.id], date
+                    ), {self.product.id: quantity}
+                )
+
+        with Transaction().set_context(company=self.company.id):
+            move(supplier, warehouse.input_location, 10, 30)
+            move(warehouse.storage_location, lost_found, 2, 25)
+            # Internal moves do not change the balance of the warehouse
+            move(warehouse.input_location, warehouse.storage_location, 5, 20)
+            move(supplier, warehouse.input_location, 4, 10)
+
+            Snapshot.update_snapshots(today - relativedelta(days=20))
+            snapshot, = Snapshot.search([])
+            self.assertEqual(snapshot.quantity, 8)
+            self.assertEqual(
+                snapshot.date, today - relativedelta(days=20)
+            )
+            check_balances()
+
+            Snapshot.update_snapshots()
+            self.assertEqual(
+                [s.quantity for s in Snapshot.search([])], [12, 8]
+            )
+            check_balances()
+
+            # A move done after the snapshots with an earlier date
+            move(warehouse.storage_location, lost_found, 1, 15)
+            # The balances include it before the next run
+            self.assertEqual(
+                [s.quantity for s in Snapshot.search([])], [8]
+            )
+            check_balances()
+            Snapshot.update_snapshots()
+            self.assertEqual(
+                [s.quantity for s in Snapshot.search([])], [11, 8]
+            )
+            check_balances()
+
+            # A move of a transaction which started before the last run but
+            # was committed after it
+            last = Snapshot.search([])[0]
+            self.assertTrue(last.moves_until < last.create_date)
+            self.assertEqual(last.quantity, 11)
+            late = move(supplier, warehouse.input_location, 3, 5)
+            started = last.create_date - relativedelta(minutes=1)
+            cursor = Transaction().connection.cursor()
+            table = StockMove.__table__()
+            cursor.execute(*table.update(
+                [table.create_date, table.write_date], [started, started],
+                where=table.id == late.id))
+            # Its invalidation ran before the snapshot of the run was
+            # committed
+            Snapshot.create([{
+                'product': self.product.id,
+                'location': warehouse.id,
+                'date': last.date,
+                'quantity': last.quantity,
+                'moves_until': last.moves_until,
+            }])
+            Snapshot.update_snapshots()
+            self.assertEqual(
+                [s.quantity for s in Snapshot.search([])], [14, 8]
+            )
+            check_balances()
+
+    @with_transaction()
+    def test_0250_test_ledger_month_cache(self):
+        """
+        The totals of the closed months are cached and invalidated by the
+        done moves of their month
+        """
+        Date = POOL.get('ir.date')
+        Location = POOL.get('stock.location')
+        StockMove = POOL.get('stock.move')
+        LedgerReport = POOL.get('report.product_ledger', type="report")
+        LedgerMonth = POOL.get('product.ledger.month')
+
+        self.setup_defaults()
+
+        month = Date.today().replace(day=1)
+        warehouse, = Location.search([('type', '=', 'warehouse')])
+        supplier, = Location.search([('type', '=', 'supplier')])
+        data = {
+            'products': [self.product.id],
+            'warehouses': [warehouse.id],
+            'start_date': month - relativedelta(months=3, days=-10),
+            'end_date': Date.today(),
+        }
+
+        def purchase(quantity, date):
+            move, = StockMove.create([{
+                'from_location': supplier.id,
+                'to_location': warehouse.input_location.id,
+                'quantity': quantity,
+                'product': self.product.id,
+                'uom': self.product.default_uom.id,
+                'unit_price': 20,
+                'effective_date': date,
+            }])
+            StockMove.assign([move])
+            StockMove.do([move])
+
+        def purchased():
+            cached = LedgerReport.get_ledger_totals([self.product.id], data)
+            summed = LedgerReport.sum_ledger_totals(
+                [self.product.id], data['start_date'], data['end_date']
+            )
+            self.assertEqual(cached, summed)
+            return cached[self.product.id]['purchased']
+
+        with Transaction().set_context(company=self.company.id):
+            self.assertEqual(
+                LedgerMonth.get_closed_months(
+                    data['start_date'], data['end_date']
+                ), [
+                    month - relativedelta(months=2),
+                    month - relativedelta(months=1),
+                ]
+            )
+            purchase(1, data['start_date'])
+            purchase(2, month - relativedelta(months=2))
+            purchase(4, month - relativedelta(days=1))
+            purchase(8, Date.today())
+
+            self.assertEqual(purchased(), 15)
+            self.assertEqual(
+                [(m.month, m.purchased) for m in LedgerMonth.search([])], [
+                    (month - relativedelta(months=1), 4),
+                    (month - relativedelta(months=2), 2),
+                ]
+            )
+
+            # A move done in a cached month
+            purchase(16, month - relativedelta(months=1))
+            self.assertEqual(
+                [m.month for m in LedgerMonth.search([])],
+                [month - relativedelta(months=2)]
+            )
+            self.assertEqual(purchased(), 31)
+            self.assertEqual(len(LedgerMonth.search([])), 2)
+
+            # The totals are unique per month and only written by the
+            # ledger for the users
+            cached = LedgerMonth.search([])[0]
+            self.assertRaises(UserError, LedgerMonth.create, [{
+                'product': cached.product.id,
+                'month': cached.month,
+            }])
+            user, = self.User.create([{
+                'name': 'Ledger User',
+                'login': 'ledger_user',
+            }])
+            purchase(32, month - relativedelta(months=1))
+            with Transaction().set_user(user.id), \
+                    Transaction().set_context(_check_access=True):
+                self.assertRaises(UserError, LedgerMonth.write, [cached], {
+                    'purchased': 0,
+                })
+                self.assertEqual(purchased(), 63)
+            self.assertEqual(len(LedgerMonth.search([])), 2)
+
+    @unittest.skipIf(PyPDF2 is None, 'PyPDF2 is not installed')
+    @with_transaction()
+    def test_0260_test_report_chunks(self):
+        """
+        Test large batches are converted once per chunk and numbered as a
+        whole
+        """
+        Report = POOL.get('report.picking_list', type="report")
+        Date = POOL.get('ir.date')
+
+        self.setup_defaults()
+
+        calls = []
+
+        def convert_pdf(cls, data, options):
+            calls.append(options)
+            return blank_pdf(1)
+
+        Report.get_chunk_size = classmethod(
+            lambda cls, action_report, ids: 2
+        )
+
+        def wkhtml_to_pdf(cls, data, options=None):
+            options = dict(options or {}, orientation='Landscape')
+            return super(Report, cls).wkhtml_to_pdf(data, options)
+
+        Report.convert_pdf = classmethod(convert_pdf)
+        # The options added by the overrides of wkhtml_to_pdf are kept
+        Report.wkhtml_to_pdf = classmethod(wkhtml_to_pdf)
+        self.addCleanup(delattr, Report, 'get_chunk_size')
+        self.addCleanup(delattr, Report, 'convert_pdf')
+        self.addCleanup(delattr, Report, 'wkhtml_to_pdf')
+
+        with Transaction().set_context({'company': self.company.id}):
+            warehouse, = self.StockLocation.search([
+                ('type', '=', 'warehouse')
+            ])
+            shipments = self.ShipmentOut.create([{
+                'planned_date': Date.today(),
+                'customer': self.party.id,
+                'warehouse': warehouse.id,
+                'delivery_address': self.party.addresses[0],
+            } for _ in range(5)])
+
+            oext, content, _, name = Report.execute(
+                [s.id for s in shipments], {}
+            )
+        self.assertEqual(oext, 'pdf')
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(all('footer-right' not in o for o in calls))
+        self.assertTrue(all(o['orientation'] == 'Landscape' for o in calls))
+        reader = PyPDF2.PdfFileReader(BytesIO(bytes(content)))
+        self.assertEqual([
+            reader.getPage(index).extractText().strip()
+            for index in range(reader.getNumPages())
+        ], ['1/3', '2/3', '3/3'])
+
 
 def suite():
     "Define suite"